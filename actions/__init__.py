@@ -1,4 +1,12 @@
-from .base import Modifier as Modifier
+from .base import (
+    Modifier as Modifier,
+    KeywordMap as KeywordMap,
+    from_keyword as from_keyword,
+    canonical_modifiers as canonical_modifiers,
+    registered_modifiers as registered_modifiers,
+    downstream_actions as downstream_actions,
+    ACTION_ORDER as ACTION_ORDER,
+)
 from .options import (
     AttackOptions as AttackOptions,
 )
@@ -22,6 +30,7 @@ from .wound import (
     devastating_wounds as devastating_wounds,
     twin_linked as twin_linked,
     anti as anti,
+    critical_wounds as critical_wounds,
     all_wounds_critical as all_wounds_critical,
 )
 from .damage import (
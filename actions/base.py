@@ -1,35 +1,148 @@
 import functools
-from typing import Concatenate, ParamSpec, TypeVar, reveal_type
+import re
+from dataclasses import dataclass
+from typing import Any, Concatenate, ParamSpec, TypeVar, reveal_type
 
 from collections.abc import Callable
 
+from outcomes import Dice, merge
+
 type ModifierFunc[T, **P] = Callable[Concatenate[list[T], P], list[T]]
 
+# The order actions are resolved in, which is also the canonical order of modifiers.
+# Modifiers of any other action, such as null, sort after these.
+ACTION_ORDER = ["attack", "hit", "wound", "save", "damage", "feel_no_pain_char"]
+
+
+def downstream_actions(action_name: str) -> tuple[str, ...]:
+    """
+    The named action and every action resolved after it.
+    """
+    return tuple(ACTION_ORDER[ACTION_ORDER.index(action_name) :])
+
+
+@dataclass(frozen=True)
+class ModifierSpec:
+    kind: str
+    action_name: str
+    name_format: str
+    func: Callable[..., list]
+    # Lower priorities apply first, e.g. changing what counts as a critical before anything uses criticals
+    priority: int
+    # The AttackOptions flags the modifier reads
+    uses_options: tuple[str, ...]
+
+
+_registry: dict[str, ModifierSpec] = {}
+
+
+def register(
+    kind: str,
+    action_name: str,
+    name_format: str,
+    func: Callable[..., list],
+    priority: int = 0,
+    uses_options: tuple[str, ...] = (),
+) -> None:
+    assert kind not in _registry, f"Modifier {kind} is already registered"
+    _registry[kind] = ModifierSpec(kind, action_name, name_format, func, priority, uses_options)
+
+
+def registered_modifiers() -> list[ModifierSpec]:
+    return list(_registry.values())
+
 
 class Modifier[T, **P]:
-    def __init__(self, name: str, action_name: str, modify_func: ModifierFunc[T, P]):
-        self.name = name
-        self.action_name = action_name
-        self.modify_func = modify_func
+    """
+    A modifier is identified by its kind and parameters alone.
+    The function that applies it is looked up in the registry, so equal modifiers compare and hash equal,
+    sort into a canonical order and pickle by value.
+    """
+
+    def __init__(self, kind: str, params: tuple[Any, ...] = ()):
+        spec = _registry[kind]
+        self.kind = kind
+        self.params = tuple(params)
+        self.name = spec.name_format.format(*self.params)
+        self.action_name = spec.action_name
+        self.priority = spec.priority
+        self.uses_options = spec.uses_options
+        self.modify_func: ModifierFunc[T, P] = (
+            functools.partial(spec.func, *self.params) if len(self.params) else spec.func
+        )
 
     def __call__(self, outcomes: list[T], *args, **kwargs) -> list[T]:
         return self.modify_func(outcomes, *args, **kwargs)
 
+    def key(self) -> tuple[str, tuple[Any, ...]]:
+        return self.kind, self.params
+
+    def sort_key(self) -> tuple[int, int, str, str]:
+        if self.action_name in ACTION_ORDER:
+            action_index = ACTION_ORDER.index(self.action_name)
+        else:
+            action_index = len(ACTION_ORDER)
+        return action_index, self.priority, self.kind, repr(self.params)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Modifier) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def __lt__(self, other) -> bool:
+        return self.sort_key() < other.sort_key()
+
+    def __reduce__(self):
+        return Modifier, self.key()
+
+    def __repr__(self) -> str:
+        return f"Modifier({self.name})"
+
+
+def canonical_modifiers(modifiers: tuple[Modifier, ...] | list[Modifier]) -> tuple[Modifier, ...]:
+    return tuple(sorted(modifiers))
+
 
 type ActionFunc[T, **P] = Callable[P, list[T]]
 
 
+# Distinct action evaluations kept, each is a handful of outcomes
+ACTION_CACHE_MAX = 10_000
+
+
 class Action[T, **P]:
+    """
+    Actions and modifiers are pure, so each action keeps the outcomes of every distinct call,
+    and the modifiers that apply to it are picked out of a weapon's modifiers only once.
+    """
+
     def __init__(self, name: str, func: ActionFunc[T, P]):
         self.name = name
         self.func = func
+        self._chains: dict[tuple[Modifier[T, P], ...], tuple[Modifier[T, P], ...]] = {}
+        self._evaluate = functools.lru_cache(maxsize=ACTION_CACHE_MAX)(self._apply)
+
+    def chain(self, modifiers: tuple[Modifier[T, P], ...] | list[Modifier[T, P]]) -> tuple[Modifier[T, P], ...]:
+        modifiers = tuple(modifiers)
+        chain = self._chains.get(modifiers)
+        if chain is None:
+            chain = tuple(m for m in modifiers if m.action_name == self.name)
+            self._chains[modifiers] = chain
+        return chain
+
+    def _apply(self, chain: tuple[Modifier[T, P], ...], args: tuple, kwargs: tuple) -> tuple[T, ...]:
+        results = self.func(*args, **dict(kwargs))
+        for modifier in chain:
+            results = modifier(results, *args, **dict(kwargs))
+        # Modifiers see every roll, the stages only need the distinct outcomes and how likely each is
+        return tuple(merge(results))
 
     def __call__(self, modifiers: list[Modifier[T, P]], *args: P.args, **kwargs: P.kwargs) -> list[T]:
-        results = self.func(*args, **kwargs)
-        for modifier in modifiers:
-            if modifier.action_name == self.name:
-                results = modifier(results, *args, **kwargs)
-        return results
+        return list(self._evaluate(self.chain(modifiers), args, tuple(sorted(kwargs.items()))))
+
+    def cache_info(self):
+        return self._evaluate.cache_info()
 
 
 def action[T, **P](action_name: str) -> Callable[[ActionFunc[T, P]], Action[T, P]]:
@@ -39,8 +152,68 @@ def action[T, **P](action_name: str) -> Callable[[ActionFunc[T, P]], Action[T, P
     return dec
 
 
-def modifier[T, **P](action: Action[T, P], name: str | None = None) -> Callable[[ModifierFunc[T, P]], Modifier[T, P]]:
+def modifier[T, **P](
+    action: Action[T, P], name: str | None = None, priority: int = 0, uses_options: tuple[str, ...] = ()
+) -> Callable[[ModifierFunc[T, P]], Modifier[T, P]]:
     def modify(func: ModifierFunc[T, P]) -> Modifier[T, P]:
-        return Modifier(func.__name__ if name is None else name, action.name, func)
+        register(func.__name__, action.name, func.__name__ if name is None else name, func, priority, uses_options)
+        return Modifier(func.__name__)
 
     return modify
+
+
+def parameterised_modifier[T, **P](
+    action: Action[T, P], name_format: str, priority: int = 0, uses_options: tuple[str, ...] = ()
+) -> Callable[[Callable[..., list[T]]], Callable[..., Modifier[T, P]]]:
+    """
+    The decorated function takes the modifier's parameters ahead of the outcomes,
+    and is replaced by a function from those parameters to the Modifier.
+    """
+
+    def modify(func: Callable[..., list[T]]) -> Callable[..., Modifier[T, P]]:
+        register(func.__name__, action.name, name_format, func, priority, uses_options)
+
+        def create(*params: Any) -> Modifier[T, P]:
+            return Modifier(func.__name__, params)
+
+        create.__name__ = func.__name__
+        create.__doc__ = func.__doc__
+        return create
+
+    return modify
+
+
+def _normalise_keyword(keyword: str) -> str:
+    return " ".join(keyword.lower().replace("_", " ").split())
+
+
+def _parse_parameter(text: str) -> Any:
+    if re.fullmatch(r"-?\d+", text):
+        return int(text)
+    elif re.fullmatch(r"\d*d\d+(\+(\d*d)?\d+)*", text):
+        return Dice.from_str(text)
+    return text
+
+
+def from_keyword(keyword: str) -> Modifier:
+    """
+    The modifier a weapon keyword, such as "Rapid Fire 1" or "Anti fly 4", names.
+    Raises a KeyError if no registered modifier matches.
+    """
+    text = _normalise_keyword(keyword)
+    for spec in _registry.values():
+        pattern = re.escape(_normalise_keyword(spec.name_format)).replace(re.escape("{}"), r"(\S+)")
+        match = re.fullmatch(pattern, text)
+        if match is not None:
+            return Modifier(spec.kind, tuple(_parse_parameter(p) for p in match.groups()))
+    raise KeyError(keyword)
+
+
+class KeywordMap(dict[str, Modifier]):
+    """
+    A map from weapon keywords to modifiers, filled from the registry as keywords are looked up.
+    """
+
+    def __missing__(self, keyword: str) -> Modifier:
+        self[keyword] = from_keyword(keyword)
+        return self[keyword]
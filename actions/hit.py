@@ -1,4 +1,4 @@
-from .base import action, modifier, Modifier
+from .base import action, modifier, parameterised_modifier, Modifier
 from .options import AttackOptions
 
 from outcomes import Outcome, Dice
@@ -17,55 +17,60 @@ def hit(weapon_skill: int, options: AttackOptions) -> list[Outcome]:
     ]
 
 
-def sustained_hits(count: int | Dice) -> Modifier:
+@parameterised_modifier(hit, "sustained_hits_{}", priority=1)
+def sustained_hits(
+    count: int | Dice, outcomes: list[Outcome], weapon_skill: int, options: AttackOptions
+) -> list[Outcome]:
     if isinstance(count, int):
-
-        @modifier(hit, f"sustained_hits_{str(count)}")
-        def update(outcomes: list[Outcome], weapon_skill: int, options: AttackOptions) -> list[Outcome]:
-            return [
-                Outcome(
-                    o.value + (count if o.success.critical() else 0),
-                    o.roll_value,
-                    o.success,
-                    o.bypass_next,
-                    o.reroll,
-                )
-                for o in outcomes
-            ]
-    else:
-
-        @modifier(hit, f"sustained_hits_{count}")
-        def update(outcomes: list[Outcome], weapon_skill: int, options: AttackOptions) -> list[Outcome]:
-            output = []
-
-            roll = count()
-
-            for o in outcomes:
-                if o.success.critical():
-                    for r in roll:
-                        output.append(Outcome(o.value + r.roll_value, o.roll_value, o.success, o.bypass_next, o.reroll))
-                else:
-                    output.append(o)
-            return output
-
-    return update
-
-
-def critical_hits(count: int) -> Modifier:
-    @modifier(hit, f"critical_hits_{count}")
-    def update(outcomes: list[Outcome], weapon_skill: int, options: AttackOptions) -> list[Outcome]:
         return [
             Outcome(
-                o.value,
+                o.value + (count if o.success.critical() else 0),
                 o.roll_value,
-                o.success if o.roll_value < count else oc.critical(),
+                o.success,
                 o.bypass_next,
                 o.reroll,
+                o.weight,
             )
             for o in outcomes
         ]
 
-    return update
+    output = []
+
+    roll = count()
+    # The extra hits split the critical's weight between them, so a critical is no more likely than before
+    total = sum(r.weight for r in roll)
+
+    for o in outcomes:
+        if o.success.critical():
+            for r in roll:
+                output.append(
+                    Outcome(
+                        o.value + r.roll_value,
+                        o.roll_value,
+                        o.success,
+                        o.bypass_next,
+                        o.reroll,
+                        o.weight * r.weight / total,
+                    )
+                )
+        else:
+            output.append(o)
+    return output
+
+
+@parameterised_modifier(hit, "critical_hits_{}")
+def critical_hits(count: int, outcomes: list[Outcome], weapon_skill: int, options: AttackOptions) -> list[Outcome]:
+    return [
+        Outcome(
+            o.value,
+            o.roll_value,
+            o.success if o.roll_value < count else oc.critical(),
+            o.bypass_next,
+            o.reroll,
+            o.weight,
+        )
+        for o in outcomes
+    ]
 
 
 @modifier(hit)
@@ -77,6 +82,7 @@ def all_hits_critical(outcomes: list[Outcome], weapon_skill: int, options: Attac
             oc.critical() if o.success else o.success,
             o.bypass_next,
             o.reroll,
+            o.weight,
         )
         for o in outcomes
     ]
@@ -91,12 +97,13 @@ def reroll_hit_1(outcomes: list[Outcome], weapon_skill: int, options: AttackOpti
             oc.critical() if o.success else o.success,
             o.bypass_next,
             o.reroll if o.roll_value != 1 else True,
+            o.weight,
         )
         for o in outcomes
     ]
 
 
-@modifier(hit)
+@modifier(hit, priority=1)
 def lethal_hits(outcomes: list[Outcome], weapon_skill: int, options: AttackOptions) -> list[Outcome]:
     return [
         Outcome(
@@ -105,12 +112,13 @@ def lethal_hits(outcomes: list[Outcome], weapon_skill: int, options: AttackOptio
             o.success,
             o.success.critical() or o.bypass_next,
             o.reroll,
+            o.weight,
         )
         for o in outcomes
     ]
 
 
-@modifier(hit)
+@modifier(hit, priority=1)
 def bypass_wound(outcomes: list[Outcome], weapon_skill: int, options: AttackOptions) -> list[Outcome]:
     return [
         Outcome(
@@ -119,6 +127,7 @@ def bypass_wound(outcomes: list[Outcome], weapon_skill: int, options: AttackOpti
             o.success,
             True,
             o.reroll,
+            o.weight,
         )
         for o in outcomes
     ]
@@ -1,7 +1,9 @@
+from collections.abc import Collection
 from typing import ParamSpec
 from dataclasses import dataclass, field
+from functools import lru_cache
 
-from .base import Modifier
+from .base import Modifier, canonical_modifiers
 
 P = ParamSpec("P")
 
@@ -13,3 +15,27 @@ class AttackOptions:
     anti_active: bool
 
     modifiers: tuple[Modifier, ...]
+
+    def __post_init__(self):
+        # Equal sets of modifiers must give equal options, whatever order the weapon listed them in
+        object.__setattr__(self, "modifiers", canonical_modifiers(self.modifiers))
+
+    def scoped(self, action_names: Collection[str]) -> "AttackOptions":
+        """
+        Only the modifiers of the named actions, and only the flags those modifiers read.
+        Everything dropped can not change the result of those actions.
+        """
+        return _scoped(self, tuple(action_names))
+
+
+# Every stage call scopes its options, so the result is kept per options and scope
+@lru_cache(maxsize=1_000)
+def _scoped(options: AttackOptions, action_names: tuple[str, ...]) -> AttackOptions:
+    modifiers = tuple(m for m in options.modifiers if m.action_name in action_names)
+    used = {flag for m in modifiers for flag in m.uses_options}
+    return AttackOptions(
+        half_range=options.half_range and "half_range" in used,
+        cover=options.cover and "cover" in used,
+        anti_active=options.anti_active and "anti_active" in used,
+        modifiers=modifiers,
+    )
@@ -1,4 +1,4 @@
-from .base import action, modifier, Modifier
+from .base import action, modifier, parameterised_modifier, Modifier
 from .options import AttackOptions
 
 from outcomes import Outcome, Dice
@@ -17,7 +17,7 @@ def wound(weapon_strength: int, target_toughness: int, options: AttackOptions) -
     ]
 
 
-@modifier(wound)
+@modifier(wound, priority=1)
 def devastating_wounds(
     outcomes: list[Outcome],
     weapon_strength: int,
@@ -31,12 +31,13 @@ def devastating_wounds(
             o.success,
             o.success.critical() or o.bypass_next,
             o.reroll,
+            o.weight,
         )
         for o in outcomes
     ]
 
 
-@modifier(wound, "twin-linked")
+@modifier(wound, "twin-linked", priority=1)
 def twin_linked(
     outcomes: list[Outcome],
     weapon_strength: int,
@@ -50,50 +51,52 @@ def twin_linked(
             o.success,
             o.success.critical() or o.bypass_next,
             True,
+            o.weight,
         )
         for o in outcomes
     ]
 
 
-def anti(keyword: str, amount: int) -> Modifier:
-    @modifier(wound, f"anti_{keyword}_{amount}")
-    def update(
-        outcomes: list[Outcome], weapon_strength: int, target_toughness: int, options: AttackOptions
-    ) -> list[Outcome]:
-        if options.anti_active:
-            return [
-                Outcome(
-                    o.value,
-                    o.roll_value,
-                    oc.critical() if o.value >= amount else o.success,
-                    o.bypass_next,
-                    o.reroll,
-                )
-                for o in outcomes
-            ]
-        else:
-            return outcomes
-
-    return update
-
-
-def critical_wounds(count: int) -> Modifier:
-    @modifier(wound, f"critical_wounds_{count}")
-    def update(
-        outcomes: list[Outcome], weapon_strength: int, target_toughness: int, options: AttackOptions
-    ) -> list[Outcome]:
+@parameterised_modifier(wound, "anti_{}_{}", uses_options=("anti_active",))
+def anti(
+    keyword: str,
+    amount: int,
+    outcomes: list[Outcome],
+    weapon_strength: int,
+    target_toughness: int,
+    options: AttackOptions,
+) -> list[Outcome]:
+    if options.anti_active:
         return [
             Outcome(
                 o.value,
                 o.roll_value,
-                o.success if o.roll_value < count else oc.critical(),
+                oc.critical() if o.value >= amount else o.success,
                 o.bypass_next,
                 o.reroll,
+                o.weight,
             )
             for o in outcomes
         ]
+    else:
+        return outcomes
+
 
-    return update
+@parameterised_modifier(wound, "critical_wounds_{}")
+def critical_wounds(
+    count: int, outcomes: list[Outcome], weapon_strength: int, target_toughness: int, options: AttackOptions
+) -> list[Outcome]:
+    return [
+        Outcome(
+            o.value,
+            o.roll_value,
+            o.success if o.roll_value < count else oc.critical(),
+            o.bypass_next,
+            o.reroll,
+            o.weight,
+        )
+        for o in outcomes
+    ]
 
 
 @modifier(wound)
@@ -107,6 +110,7 @@ def all_wounds_critical(
             oc.critical() if o.success else o.success,
             o.bypass_next,
             o.reroll,
+            o.weight,
         )
         for o in outcomes
     ]
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Above this many cells the lattice is indexed sparsely with np.unique instead of a dense bincount.
+DENSE_LATTICE_MAX = 1 << 22
+
+Keys = np.ndarray
+Probabilities = np.ndarray
+
+
+def radices(*keys: Keys) -> np.ndarray:
+    """
+    The per slot radix of the smallest lattice that holds the sum of one row from each of keys.
+    """
+    width = keys[0].shape[1]
+    res = np.ones(width, dtype=np.int64)
+    for k in keys:
+        if len(k):
+            res += k.max(axis=0)
+    return res
+
+
+def lattice_size(radix: np.ndarray) -> int:
+    size = 1
+    for r in radix:
+        size *= int(r)
+    return size
+
+
+def pack(keys: Keys, radix: np.ndarray) -> np.ndarray:
+    multipliers = np.cumprod(np.concatenate(([1], radix[:-1]))).astype(np.int64)
+    return keys.astype(np.int64) @ multipliers
+
+
+def unpack(packed: np.ndarray, radix: np.ndarray) -> Keys:
+    keys = np.empty((len(packed), len(radix)), dtype=np.int64)
+    rest = packed.astype(np.int64)
+    for ii, r in enumerate(radix):
+        rest, keys[:, ii] = np.divmod(rest, r)
+    return keys
+
+
+def _merge_packed(packed: np.ndarray, probs: Probabilities, radix: np.ndarray) -> tuple[Keys, Probabilities]:
+    size = lattice_size(radix)
+    if size <= DENSE_LATTICE_MAX:
+        dense = np.bincount(packed, weights=probs, minlength=size)
+        index = np.flatnonzero(np.bincount(packed, minlength=size))
+        return unpack(index, radix), dense[index]
+
+    index, inverse = np.unique(packed, return_inverse=True)
+    return unpack(index, radix), np.bincount(inverse, weights=probs)
+
+
+def merge(keys: Keys, probs: Probabilities) -> tuple[Keys, Probabilities]:
+    """
+    Sums the probabilities of identical keys.
+    """
+    if len(keys) == 0:
+        return keys, probs
+    radix = radices(keys)
+    if lattice_size(radix) >= np.iinfo(np.int64).max:
+        index, inverse = np.unique(keys, axis=0, return_inverse=True)
+        return index, np.bincount(inverse.reshape(-1), weights=probs)
+    return _merge_packed(pack(keys, radix), probs, radix)
+
+
+def convolve(
+    first_keys: Keys, first_probs: Probabilities, second_keys: Keys, second_probs: Probabilities
+) -> tuple[Keys, Probabilities]:
+    """
+    The distribution of the sum of two independent key distributions.
+    """
+    radix = radices(first_keys, second_keys)
+    if lattice_size(radix) >= np.iinfo(np.int64).max:
+        keys = (first_keys[:, None, :] + second_keys[None, :, :]).reshape(-1, first_keys.shape[1])
+        return merge(keys, np.outer(first_probs, second_probs).reshape(-1))
+
+    packed = (pack(first_keys, radix)[:, None] + pack(second_keys, radix)[None, :]).reshape(-1)
+    return _merge_packed(packed, np.outer(first_probs, second_probs).reshape(-1), radix)
+
+
+def mix(parts: list[tuple[Keys, Probabilities, float]]) -> tuple[Keys, Probabilities]:
+    """
+    The weighted sum of several key distributions, each weight scaling the whole part.
+    """
+    keys = np.concatenate([k for k, _, _ in parts])
+    probs = np.concatenate([p * w for _, p, w in parts])
+    return merge(keys, probs)
@@ -1,11 +1,42 @@
 from collections import defaultdict
+from collections.abc import Callable
+from typing import Any
+from weakref import WeakKeyDictionary
+import itertools
+import math
+import weakref
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+import dense
+
 Probability = float
 
 max_damage = 20
 
+DICT_BACKEND = "dict"
+NUMPY_BACKEND = "numpy"
+
+
+@dataclass(frozen=True)
+class EngineOptions:
+    """
+    Selects how event trees are expanded into outcomes.
+    The dict backend joins EventResults one pair at a time, the numpy backend convolves arrays of results.
+    Damage sizes above the horizon are folded into the horizon as they are rolled, which keeps the
+    outcomes smaller and changes nothing capped at or below the horizon.
+    """
+
+    backend: str = DICT_BACKEND
+    horizon: int = max_damage
+    # Above zero, every stage drops its outcomes less likely than this, see prune
+    epsilon: float = 0.0
+
+
+DEFAULT_ENGINE = EngineOptions()
+
 
 @dataclass(frozen=True)
 class EventResult:
@@ -47,14 +78,174 @@ def failure() -> EventResult:
     return EventResult(tuple([0 for _ in range(max_damage)]), count=0)
 
 
+DenseOutcomes = tuple[np.ndarray, np.ndarray]
+
+
+def to_dense(outcomes: dict[EventResult, Probability]) -> DenseOutcomes:
+    keys = np.array([key.results for key in outcomes.keys()], dtype=np.int64).reshape(-1, max_damage)
+    probs = np.array(list(outcomes.values()), dtype=np.float64)
+    return keys, probs
+
+
+def from_dense(outcomes: DenseOutcomes) -> dict[EventResult, Probability]:
+    keys, probs = outcomes
+    res = {}
+    for row, prob in zip(keys.tolist(), probs.tolist(), strict=True):
+        count = max([ii + 1 if v else 0 for ii, v in enumerate(row)])
+        res[EventResult(tuple(row), count)] = prob
+    return res
+
+
+# Expansions with more outcomes than this are not kept on the node
+OUTCOME_CACHE_MAX = 100_000
+
+# Roughly what one outcome costs, as an EventResult in a dict or as a row of dense arrays
+OUTCOME_BYTES = 200
+
+
+class ProbabilityTreeTooLargeError(Exception):
+    def __init__(self, message: str, estimate: int):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+@dataclass(frozen=True)
+class Budget:
+    """
+    The most outcomes a single expansion may have, and the most bytes it may hold at once.
+    Expansions are checked against an upper bound before they start, and again as they join.
+    """
+
+    max_outcomes: int = 20_000_000
+    max_bytes: int = 4 << 30
+
+
+_budget = Budget()
+
+
+def set_budget(budget: Budget) -> Budget:
+    """
+    Replaces the budget, returning the one it replaced.
+    """
+    global _budget
+    previous, _budget = _budget, budget
+    return previous
+
+
+@dataclass(frozen=True)
+class Estimate:
+    """
+    An upper bound on the number of outcomes, the most instances of each damage size any outcome has,
+    and the most instances any outcome has in total.
+    """
+
+    outcomes: int
+    top: np.ndarray
+    instances: int
+
+
+def _bound(top: np.ndarray, instances: int) -> int:
+    # Outcomes are distinct keys, so there can be no more than the keys below top,
+    # nor more than the multisets of at most instances sizes drawn from the sizes in use
+    sizes = int(np.count_nonzero(top))
+    return min(math.prod(int(t) + 1 for t in top), math.comb(instances + sizes, sizes))
+
+
+def _power_bound(estimate: Estimate, amount: int) -> int:
+    # amount repeats of an event can only combine into multisets of its outcomes
+    multisets = math.comb(amount + estimate.outcomes - 1, amount)
+    return min(multisets, _bound(amount * estimate.top, amount * estimate.instances))
+
+
+def check_budget(tree: "EventSet") -> None:
+    outcomes = tree.estimate().outcomes
+    if outcomes > _budget.max_outcomes or outcomes * OUTCOME_BYTES > _budget.max_bytes:
+        title = f"{tree._title()}({tree.name})"
+        raise ProbabilityTreeTooLargeError(
+            f"{title} may have up to {outcomes:,} outcomes, about {outcomes * OUTCOME_BYTES:,} bytes", outcomes
+        )
+
+
+def _check_joined(size: int) -> None:
+    if size > _budget.max_outcomes or size * OUTCOME_BYTES > _budget.max_bytes:
+        raise ProbabilityTreeTooLargeError(f"Join reached {size:,} outcomes", size)
+
+
+_outcome_stats = {"hits": 0, "misses": 0, "too_large": 0}
+
+
+def outcome_cache_info() -> dict[str, int]:
+    return dict(_outcome_stats)
+
+
 class EventSet(ABC):
-    def __init__(self, events: tuple["EventSet", ...] | list["EventSet"], name="", probability: Probability = 1.0):
+    """
+    Nodes are immutable once built, so outcomes() and dense_outcomes() keep their result on the node.
+    Pass cache=False, or set cache_outcomes on the class, to always recompute instead.
+    """
+
+    __slots__ = ("events", "name", "probability", "cache", "_outcome_cache", "_dense_cache", "__weakref__")
+
+    cache_outcomes = True
+
+    def __init__(
+        self,
+        events: tuple["EventSet", ...] | list["EventSet"],
+        name="",
+        probability: Probability = 1.0,
+        cache: bool | None = None,
+    ):
         self.events = events if isinstance(events, tuple) else tuple(events)
         self.name = name
         self.probability = probability
+        self.cache = self.cache_outcomes if cache is None else cache
+        self._outcome_cache = None
+        self._dense_cache = None
+
+    def outcomes(self) -> dict[EventResult, Probability]:
+        if self._outcome_cache is not None:
+            _outcome_stats["hits"] += 1
+            return self._outcome_cache
+        res = self._outcomes()
+        if self._keep(len(res)):
+            self._outcome_cache = res
+        return res
+
+    def dense_outcomes(self) -> DenseOutcomes:
+        if self._dense_cache is not None:
+            _outcome_stats["hits"] += 1
+            return self._dense_cache
+        res = self._dense_outcomes()
+        if self._keep(len(res[1])):
+            self._dense_cache = res
+        return res
+
+    def _keep(self, size: int) -> bool:
+        if not self.cache:
+            return False
+        _outcome_stats["misses"] += 1
+        if size > OUTCOME_CACHE_MAX:
+            _outcome_stats["too_large"] += 1
+            return False
+        return True
 
     @abstractmethod
-    def outcomes(self) -> dict[EventResult, Probability]: ...
+    def _outcomes(self) -> dict[EventResult, Probability]: ...
+
+    @abstractmethod
+    def deficit(self) -> float:
+        """
+        The fraction of the probability lost to pruning somewhere below this node.
+        """
+
+    @abstractmethod
+    def estimate(self) -> Estimate:
+        """
+        Cheap, as it only looks at the sizes of the children and never expands them.
+        """
+
+    def _dense_outcomes(self) -> DenseOutcomes:
+        return to_dense(self.outcomes())
 
     @abstractmethod
     def _title(self) -> str: ...
@@ -67,6 +258,8 @@ class EventSet(ABC):
 
 
 class Leaf(EventSet):
+    cache_outcomes = False
+
     def __init__(self, name: str, outcome: EventResult, probability: Probability = 1.0):
         super().__init__(tuple(), name=name, probability=probability)
         self.outcome = outcome
@@ -77,69 +270,473 @@ class Leaf(EventSet):
     def __repr__(self) -> str:
         return f"{self.name}:{repr(self.outcome)}"
 
-    def outcomes(self) -> dict[EventResult, Probability]:
+    def _outcomes(self) -> dict[EventResult, Probability]:
         return {self.outcome: self.probability}
 
+    def _dense_outcomes(self) -> DenseOutcomes:
+        return np.array([self.outcome.results], dtype=np.int64), np.array([self.probability])
+
+    def estimate(self) -> Estimate:
+        return Estimate(1, np.array(self.outcome.results, dtype=np.int64), sum(self.outcome.results))
+
+    def deficit(self) -> float:
+        return 0.0
+
+
+def join_outcomes(
+    first: dict[EventResult, Probability], second: dict[EventResult, Probability]
+) -> dict[EventResult, Probability]:
+    outcome_map = defaultdict(float)
+    for key, prob in first.items():
+        for this_key, this_prob in second.items():
+            new_key = EventResult.join(key, this_key)
+            outcome_map[new_key] += prob * this_prob
+    _check_joined(len(outcome_map))
+    return outcome_map
+
+
+def repeat_outcomes(event: "EventSet", amount: int, dense_backend: bool = False, memo: dict[int, Any] | None = None):
+    """
+    The outcomes of amount independent repeats of event, built by repeated squaring.
+    Squaring joins two large maps, so when the half power is already too big for that to beat
+    stepping up one repeat at a time, power amount is built from power amount - 1 instead.
+    Every power computed on the way is kept in memo, which is local to the call unless the caller passes its own, so
+    the recursion never builds one twice. They are also put in the power cache, so later requests for any power of the
+    same event reuse them until it evicts them. Dense powers are kept there as Distributions and padded back out on use.
+    """
+    if memo is None:
+        memo = {}
+    if amount in memo:
+        return memo[amount]
+    key = (_power_id(event), dense_backend, amount)
+    cached = _MISSING if _power_cache is None else _power_cache.get("power", key, _MISSING)
+    if cached is not _MISSING:
+        _power_stats["hits"] += 1
+        memo[amount] = cached.dense_outcomes() if dense_backend else cached
+        return memo[amount]
+    _power_stats["misses"] += 1
+
+    join = _dense_join if dense_backend else join_outcomes
+    if amount == 1:
+        res = event.dense_outcomes() if dense_backend else event.outcomes()
+    else:
+        base = repeat_outcomes(event, 1, dense_backend, memo)
+        half = repeat_outcomes(event, amount // 2, dense_backend, memo)
+        if _size(half) <= (amount - amount // 2) * _size(base):
+            res = join(half, half)
+            if amount % 2:
+                res = join(res, base)
+        else:
+            res = join(repeat_outcomes(event, amount - 1, dense_backend, memo), base)
+    memo[amount] = res
+    if _power_cache is not None:
+        _power_cache.put("power", key, Distribution(*res) if dense_backend else res)
+        _power_keys[key[0]].add(key)
+    return res
+
+
+def power_series(event: "EventSet", amount: int, dense_backend: bool = False):
+    """
+    Yields the outcomes of 1 to amount repeats of event in order.
+    Each power is built from the one before it, or from the half when squaring that is cheaper.
+    """
+    memo: dict[int, Any] = {}
+    for ii in range(1, amount + 1):
+        yield repeat_outcomes(event, ii, dense_backend, memo)
+
+
+def _dense_join(first: "DenseOutcomes", second: "DenseOutcomes") -> "DenseOutcomes":
+    # The join builds a packed key and a probability for every pair before merging them
+    pairs = len(first[1]) * len(second[1])
+    if pairs * 16 > _budget.max_bytes:
+        raise ProbabilityTreeTooLargeError(f"Join of {pairs:,} pairs needs about {pairs * 16:,} bytes", pairs)
+    return dense.convolve(*first, *second)
+
+
+def _size(outcomes) -> int:
+    return len(outcomes[0]) if isinstance(outcomes, tuple) else len(outcomes)
+
+
+_MISSING = object()
+# Where powers are kept, anything with the get, put and discard of roll.StageCache. roll puts them in the stage cache,
+# so they count against the same memory budget and are evicted along with the stages
+_power_cache: Any = None
+# Events are keyed by a serial number, so the cache does not keep them alive, and ids are never reused
+_power_ids: WeakKeyDictionary["EventSet", int] = WeakKeyDictionary()
+_power_keys: dict[int, set[tuple[int, bool, int]]] = {}
+_power_serials = itertools.count()
+_power_stats = {"hits": 0, "misses": 0}
+
+
+def set_power_cache(cache: Any) -> None:
+    global _power_cache
+    _power_cache = cache
+
+
+def _power_id(event: "EventSet") -> int:
+    serial = _power_ids.get(event)
+    if serial is None:
+        serial = next(_power_serials)
+        _power_ids[event] = serial
+        _power_keys[serial] = set()
+        weakref.finalize(event, _forget_powers, serial)
+    return serial
+
+
+def _discard_powers(serial: int) -> None:
+    for key in _power_keys.get(serial, ()):
+        _power_cache.discard("power", key)
+    _power_keys.get(serial, set()).clear()
+
+
+def _forget_powers(serial: int) -> None:
+    _discard_powers(serial)
+    _power_keys.pop(serial, None)
+
+
+def drop_powers(event: "EventSet") -> None:
+    """
+    Forgets every power of the event, which also happens by itself once nothing else holds the event.
+    """
+    if event in _power_ids:
+        _discard_powers(_power_ids[event])
+
+
+def drop_all_powers() -> None:
+    for serial in _power_keys:
+        _discard_powers(serial)
+
+
+def power_cache_info() -> dict[str, int]:
+    return dict(_power_stats, events=len(_power_ids))
+
 
 class All(EventSet):
     def _title(self) -> str:
         return "A"
 
-    def outcomes(self) -> dict[EventResult, Probability]:
-        outcome_map = defaultdict(float)
-
-        for ii, event in enumerate(self.events):
-            set_outcomes = event.outcomes()
-            if ii == 0:
-                for key, prob in set_outcomes.items():
-                    outcome_map[key] += prob
+    def _repeats(self) -> list[tuple[EventSet, int]]:
+        # Identical children (the same node repeated) are expanded as a single power
+        counts: dict[int, list] = {}
+        for event in self.events:
+            counts.setdefault(id(event), [event, 0])[1] += 1
+        return [(event, amount) for event, amount in counts.values()]
+
+    def estimate(self) -> Estimate:
+        outcomes = 1
+        top = np.zeros(max_damage, dtype=np.int64)
+        instances = 0
+        for event, amount in self._repeats():
+            estimate = event.estimate()
+            outcomes *= _power_bound(estimate, amount)
+            top += amount * estimate.top
+            instances += amount * estimate.instances
+        return Estimate(min(outcomes, _bound(top, instances)), top, instances)
+
+    def deficit(self) -> float:
+        kept = 1.0
+        for event, amount in self._repeats():
+            kept *= (1 - event.deficit()) ** amount
+        return 1 - kept
+
+    def _outcomes(self) -> dict[EventResult, Probability]:
+        check_budget(self)
+        outcome_map = None
+        for event, amount in self._repeats():
+            set_outcomes = repeat_outcomes(event, amount) if amount > 1 else event.outcomes()
+            if outcome_map is None:
+                outcome_map = defaultdict(float, set_outcomes)
             else:
-                new_outcome_map = defaultdict(float)
-                for key, prob in outcome_map.items():
-                    for this_key, this_prob in set_outcomes.items():
-                        new_key = EventResult.join(key, this_key)
-                        new_outcome_map[new_key] += prob * this_prob
-                outcome_map = new_outcome_map
+                outcome_map = join_outcomes(outcome_map, set_outcomes)
+        return outcome_map if outcome_map is not None else defaultdict(float)
+
+    def _dense_outcomes(self) -> DenseOutcomes:
+        check_budget(self)
+        res = None
+        for event, amount in self._repeats():
+            set_outcomes = repeat_outcomes(event, amount, True) if amount > 1 else event.dense_outcomes()
+            res = set_outcomes if res is None else _dense_join(res, set_outcomes)
+        return res if res is not None else (np.zeros((0, max_damage), dtype=np.int64), np.zeros(0))
+
+
+class Power(All):
+    """
+    amount independent repeats of a single event.
+    """
+
+    def __init__(
+        self, event: EventSet, amount: int, name="", probability: Probability = 1.0, cache: bool | None = None
+    ):
+        super().__init__((event,), name=name, probability=probability, cache=cache)
+        self.amount = amount
+
+    def _title(self) -> str:
+        return f"P{self.amount}"
+
+    def _repeats(self) -> list[tuple[EventSet, int]]:
+        return [(self.events[0], self.amount)]
+
+
+class Compound(EventSet):
+    """
+    A random number of independent repeats of a single event.
+    counts maps a number of repeats to its weight, and the outcomes sum to the total weight,
+    the same way a Leaf's outcomes sum to its probability.
+    Powers are built once, in order, and each is weighted by its count.
+    """
+
+    def __init__(self, event: EventSet, counts: dict[int, Probability], name="", cache: bool | None = None):
+        super().__init__((event,), name=name, probability=sum(counts.values()), cache=cache)
+        self.counts = counts
+
+    def _title(self) -> str:
+        return "C"
+
+    def estimate(self) -> Estimate:
+        estimate = self.events[0].estimate()
+        outcomes = sum(_power_bound(estimate, ii) for ii in self.counts)
+        top = max(self.counts) * estimate.top
+        instances = max(self.counts) * estimate.instances
+        return Estimate(min(outcomes, _bound(top, instances)), top, instances)
+
+    def deficit(self) -> float:
+        kept = 1 - self.events[0].deficit()
+        return sum(count * (1 - kept**ii) for ii, count in self.counts.items()) / self.probability
+
+    def _outcomes(self) -> dict[EventResult, Probability]:
+        check_budget(self)
+        outcome_map = defaultdict(float)
+        if self.counts.get(0, 0.0):
+            outcome_map[failure()] += self.counts[0]
+        for ii, power in enumerate(power_series(self.events[0], max(self.counts)), start=1):
+            if ii in self.counts:
+                for key, prob in power.items():
+                    outcome_map[key] += prob * self.counts[ii]
         return outcome_map
 
+    def _dense_outcomes(self) -> DenseOutcomes:
+        check_budget(self)
+        parts = []
+        if self.counts.get(0, 0.0):
+            parts.append((*Leaf("none", failure()).dense_outcomes(), self.counts[0]))
+        for ii, power in enumerate(power_series(self.events[0], max(self.counts), True), start=1):
+            if ii in self.counts:
+                parts.append((*power, self.counts[ii]))
+        return dense.mix(parts)
+
 
 class Together(EventSet):
+    """
+    One of the events, each as likely as its probability times its weight.
+    """
+
+    __slots__ = ("weights",)
+
+    def __init__(
+        self,
+        events: list["EventSet"] | tuple["EventSet", ...],
+        name: str = "",
+        probability: Probability = 1.0,
+        cache: bool | None = None,
+        weights: list[float] | tuple[float, ...] | None = None,
+    ):
+        super().__init__(events, name=name, probability=probability, cache=cache)
+        self.weights = tuple(1.0 for _ in self.events) if weights is None else tuple(weights)
+        assert len(self.weights) == len(self.events)
+
     def _title(self) -> str:
         return "T"
 
-    def outcomes(self) -> dict[EventResult, Probability]:
-        total_prob = sum(e.probability for e in self.events)
-        fractional_probability = 1.0 / total_prob
+    def estimate(self) -> Estimate:
+        estimates = [e.estimate() for e in self.events]
+        top = np.zeros(max_damage, dtype=np.int64)
+        for estimate in estimates:
+            top = np.maximum(top, estimate.top)
+        instances = max(estimate.instances for estimate in estimates)
+        return Estimate(min(sum(e.outcomes for e in estimates), _bound(top, instances)), top, instances)
+
+    def deficit(self) -> float:
+        weighted = zip(self.events, self.weights, strict=True)
+        return sum(e.probability * w * e.deficit() for e, w in weighted) / self._total()
+
+    def _total(self) -> Probability:
+        return sum(e.probability * w for e, w in zip(self.events, self.weights, strict=True))
+
+    def _outcomes(self) -> dict[EventResult, Probability]:
+        total_prob = self._total()
 
         outcome_map = defaultdict(float)
-        for event in self.events:
+        for event, weight in zip(self.events, self.weights, strict=True):
             event_outcomes = event.outcomes()
             for key, prob in event_outcomes.items():
-                outcome_map[key] += prob * fractional_probability
+                outcome_map[key] += prob * weight / total_prob
 
-        if abs(sum(outcome_map.values()) - 1) > 1e-7:
-            raise ValueError(f"Expected outcome ({abs(sum(outcome_map.values()) - 1)}) to be < 1e-7")
+        expected = 1 - self.deficit()
+        if abs(sum(outcome_map.values()) - expected) > 1e-7:
+            raise ValueError(f"Expected outcome ({abs(sum(outcome_map.values()) - expected)}) to be < 1e-7")
         return outcome_map
 
+    def _dense_outcomes(self) -> DenseOutcomes:
+        total_prob = self._total()
+        weighted = list(zip(self.events, self.weights, strict=True))
+        leaves = [(e, w) for e, w in weighted if isinstance(e, Leaf)]
+        parts = [(*e.dense_outcomes(), w / total_prob) for e, w in weighted if not isinstance(e, Leaf)]
+        if len(leaves):
+            # Collapsed trees hold thousands of leaves, so build their arrays in one go
+            leaf_keys = np.array([e.outcome.results for e, _ in leaves], dtype=np.int64)
+            parts.append((leaf_keys, np.array([e.probability * w for e, w in leaves]), 1.0 / total_prob))
+        keys, probs = dense.mix(parts)
+
+        expected = 1 - self.deficit()
+        if abs(probs.sum() - expected) > 1e-7:
+            raise ValueError(f"Expected outcome ({abs(probs.sum() - expected)}) to be < 1e-7")
+        return keys, probs
+
+
+class Distribution(EventSet):
+    """
+    A collapsed set of outcomes held as arrays rather than as one Leaf per outcome.
+    Row ii of the keys is EventResult.results of outcome ii, with the always zero trailing
+    slots dropped, stored in the smallest integer type that fits. probs holds the probabilities.
+    Once pruned the probabilities sum to less than one, and support keeps the estimate of the
+    full distribution, so bounds on what was pruned stay valid.
+    """
+
+    __slots__ = ("keys", "probs", "support")
+
+    # The arrays already are the expansion, keeping a dict of it as well would undo the compaction
+    cache_outcomes = False
+
+    def __init__(self, keys: np.ndarray, probs: np.ndarray, name: str = "", support: Estimate | None = None):
+        super().__init__(tuple(), name=name, probability=1.0)
+        self.support = support
+        width = 0
+        if len(keys):
+            used = np.flatnonzero(keys.any(axis=0))
+            width = used[-1] + 1 if len(used) else 0
+        top = int(keys.max()) if keys.size else 0
+        self.keys = np.ascontiguousarray(keys[:, :width], dtype=np.min_scalar_type(top))
+        self.probs = np.ascontiguousarray(probs, dtype=np.float64)
+
+    @staticmethod
+    def from_outcomes(outcomes: dict[EventResult, Probability], name: str = "") -> "Distribution":
+        return Distribution(*to_dense(outcomes), name=name)
+
+    def _title(self) -> str:
+        return "D"
+
+    def __repr__(self) -> str:
+        prefix = f"{self.name}:" if len(self.name) else ""
+        return f"{self._title()}({prefix}{len(self)} outcomes)"
+
+    def __len__(self) -> int:
+        return len(self.probs)
+
+    def __reduce__(self):
+        return Distribution, (self.keys, self.probs, self.name, self.support)
+
+    def estimate(self) -> Estimate:
+        top = np.zeros(max_damage, dtype=np.int64)
+        instances = 0
+        if len(self) and self.keys.shape[1]:
+            top[: self.keys.shape[1]] = self.keys.max(axis=0)
+            instances = int(self.keys.sum(axis=1, dtype=np.int64).max())
+        if self.support is not None:
+            top = np.maximum(top, self.support.top)
+            instances = max(instances, self.support.instances)
+        return Estimate(len(self), top, instances)
+
+    def deficit(self) -> float:
+        if self.support is None:
+            # Never pruned, anything missing is rounding
+            return 0.0
+        return max(0.0, 1.0 - float(self.probs.sum()))
+
+    def _dense_outcomes(self) -> DenseOutcomes:
+        keys = np.zeros((len(self.probs), max_damage), dtype=np.int64)
+        keys[:, : self.keys.shape[1]] = self.keys
+        return keys, self.probs
+
+    def _outcomes(self) -> dict[EventResult, Probability]:
+        return from_dense(self.dense_outcomes())
+
+    def totals(self) -> np.ndarray:
+        return self.keys.astype(np.int64) @ np.arange(1, self.keys.shape[1] + 1)
+
+
+def evaluate(tree: EventSet, engine: EngineOptions = DEFAULT_ENGINE) -> dict[EventResult, Probability]:
+    if engine.backend == NUMPY_BACKEND:
+        return from_dense(tree.dense_outcomes())
+    elif engine.backend == DICT_BACKEND:
+        return tree.outcomes()
+    raise ValueError(f"Unknown backend: {engine.backend}")
+
+
+def collapse_tree(
+    tree: dict[EventResult, Probability] | EventSet | list[EventSet],
+    name: str = "",
+    engine: EngineOptions = DEFAULT_ENGINE,
+    weights: list[float] | None = None,
+) -> Distribution:
+    if isinstance(tree, list):
+        tree = Together(tree, weights=weights)
 
-def collapse_tree(tree: dict[EventResult, Probability] | EventSet | list[EventSet], name: str = "") -> Together:
-    map: dict[EventResult, Probability] = {}
     if isinstance(tree, dict):
-        map = tree
-    elif isinstance(tree, EventSet):
-        map = tree.outcomes()
-    elif isinstance(tree, list):
-        map = Together(tree).outcomes()
+        return Distribution.from_outcomes(tree, name=name)
+    elif engine.backend == NUMPY_BACKEND:
+        res = Distribution(*tree.dense_outcomes(), name=name)
+    else:
+        res = Distribution.from_outcomes(evaluate(tree, engine), name=name)
+    if engine.epsilon > 0:
+        res = prune(res, engine.epsilon, tree.estimate())
+    return res
 
-    res = []
-    for key, prob in map.items():
-        res.append(Leaf("a", key, probability=prob))
-    return Together(res, name=name)
+
+def prune(tree: Distribution, epsilon: float, support: Estimate | None = None) -> Distribution:
+    """
+    Drops the outcomes less likely than epsilon, leaving their probability missing from the total.
+    Pruned stages only ever lose probability as they are combined, never gain it, so every
+    probability in the end result is at most its exact value and the deficit bounds the error.
+    """
+    estimate = tree.estimate()
+    if support is not None:
+        estimate = Estimate(
+            estimate.outcomes, np.maximum(estimate.top, support.top), max(estimate.instances, support.instances)
+        )
+    keep = tree.probs >= epsilon
+    return Distribution(tree.keys[keep], tree.probs[keep], name=tree.name, support=estimate)
+
+
+def approximation_error(tree: EventSet, caps: list[int]) -> tuple[float, np.ndarray]:
+    """
+    The probability pruned from tree, which bounds the error of every damage_k+ probability, and the
+    bound that gives on the error of the average capped at each of caps. The exact values are never
+    below the pruned ones, nor above them by more than the bound.
+    """
+    # A compound of a pruned distribution may be missing probability from its counts as well
+    discarded = 1 - tree.probability * (1 - tree.deficit())
+    estimate = tree.estimate()
+    caps = np.array(caps)
+    most = estimate.top @ np.minimum(np.arange(1, max_damage + 1)[:, None], caps[None, :])
+    return discarded, discarded * np.minimum(most, estimate.instances * caps)
 
 
 def cap_damage(
     tree: dict[EventResult, Probability] | EventSet | list[EventSet], cap: int
-) -> dict[EventResult, Probability]:
+) -> dict[EventResult, Probability] | Distribution:
+    if isinstance(tree, Distribution):
+        assert cap <= max_damage
+        keys, probs = tree.dense_outcomes()
+        capped = keys[:, :cap].copy()
+        capped[:, cap - 1] += keys[:, cap:].sum(axis=1)
+        support = None
+        if tree.support is not None:
+            top = np.zeros(max_damage, dtype=np.int64)
+            top[:cap] = tree.support.top[:cap]
+            top[cap - 1] += tree.support.top[cap:].sum()
+            support = Estimate(tree.support.outcomes, top, tree.support.instances)
+        return Distribution(*dense.merge(capped, probs), name=tree.name, support=support)
+
     map: dict[EventResult, Probability] = {}
     if isinstance(tree, dict):
         map = tree
@@ -155,7 +752,123 @@ def cap_damage(
     return res
 
 
+def modify_damage(tree: Distribution, modify: Callable[[int], int]) -> Distribution:
+    """
+    Every instance of damage of size ii becomes one of size modify(ii), or none when that is 0,
+    and the outcomes that become the same are merged. Instances folded into the last slot stay folded.
+    """
+    sizes = np.array([modify(ii) for ii in range(1, max_damage + 1)], dtype=np.int64)
+    assert sizes.max() <= max_damage
+    remap = np.zeros((max_damage, max_damage), dtype=np.int64)
+    kept = np.flatnonzero(sizes > 0)
+    remap[kept, sizes[kept] - 1] = 1
+    support = None
+    if tree.support is not None:
+        support = Estimate(tree.support.outcomes, tree.support.top @ remap, tree.support.instances)
+    keys = tree.keys.astype(np.int64) @ remap[: tree.keys.shape[1]]
+    return Distribution(*dense.merge(keys, tree.probs), name=tree.name, support=support)
+
+
+def capped_damage_summary(
+    tree: dict[EventResult, Probability] | EventSet | list[EventSet], caps: list[int], damage_n: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    average_damage and cumulative_damage_probabilities of cap_damage(tree, cap) for every cap at once.
+    Returns the averages, one per cap, and a caps by damage_n array of the chance of at least 1..damage_n damage.
+    """
+    averages, exact = capped_totals(tree, caps, damage_n)
+    return averages, at_least_damage(exact)
+
+
+def capped_totals(
+    tree: dict[EventResult, Probability] | EventSet | list[EventSet], caps: list[int], damage_n: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The averages of cap_damage(tree, cap) for every cap, and a caps by damage_n + 1 array of the chance
+    of each total of it, where damage_n stands for damage_n or more.
+    """
+    if isinstance(tree, Compound) and isinstance(tree.events[0], Distribution):
+        return _compound_capped_totals(tree.events[0], tree.counts, caps, damage_n)
+    if not isinstance(tree, Distribution):
+        tree = collapse_tree(tree)
+    width = tree.keys.shape[1]
+    # An instance of size ii + 1 does min(ii + 1, cap) damage once capped
+    sizes = np.arange(1, width + 1)[:, None]
+    totals = tree.keys.astype(np.int64) @ np.minimum(sizes, np.array(caps)[None, :])
+    averages = tree.probs @ totals
+
+    index = np.minimum(totals, damage_n) + (damage_n + 1) * np.arange(len(caps))[None, :]
+    exact = np.bincount(
+        index.reshape(-1), weights=np.repeat(tree.probs, len(caps)), minlength=len(caps) * (damage_n + 1)
+    )
+    return averages, exact.reshape(len(caps), damage_n + 1)
+
+
+def at_least_damage(exact: np.ndarray) -> np.ndarray:
+    """
+    The chance of at least 1..damage_n damage per cap, from the chances capped_totals returns.
+    """
+    return np.cumsum(exact[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+
+def _capped_steps(single: np.ndarray) -> np.ndarray:
+    # Per cap, the chance of moving from every total so far to the next one, adding a total with the chances single
+    damage_n = single.shape[1] - 1
+    steps = np.zeros((len(single), damage_n + 1, damage_n + 1))
+    for jj in range(damage_n + 1):
+        steps[:, jj, jj:damage_n] = single[:, : damage_n - jj]
+        steps[:, jj, damage_n] = single[:, damage_n - jj :].sum(axis=1)
+    return steps
+
+
+def _compound_capped_totals(
+    event: Distribution, counts: dict[int, Probability], caps: list[int], damage_n: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    capped_totals of the compound of event without expanding it. Capping applies to each instance,
+    so per cap the capped total of the compound is a sum of independent capped totals of event,
+    and every total from damage_n up can be kept together as damage_n.
+    """
+    averages, single = capped_totals(event, caps, damage_n)
+    averages = averages * sum(ii * count for ii, count in counts.items())
+    steps = _capped_steps(single)
+
+    power = np.zeros((len(caps), damage_n + 1))
+    power[:, 0] = 1
+    exact = counts.get(0, 0.0) * power
+    for ii in range(1, max(counts, default=0) + 1):
+        power = np.einsum("cj,cjk->ck", power, steps)
+        if ii in counts:
+            exact = exact + counts[ii] * power
+    return averages, exact
+
+
+def add_capped_totals(parts: list[tuple[np.ndarray, np.ndarray, int]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    capped_totals of independent trees together, from the averages and chances capped_totals returns for each
+    and how many times it is repeated. Per cap the total is the sum of their totals, so this only convolves them.
+    """
+    averages = sum(count * part_averages for part_averages, _, count in parts)
+    # Nothing yet, which is a total of 0 for certain
+    exact = np.zeros_like(parts[0][1])
+    exact[:, 0] = 1
+    for _, part_exact, count in parts:
+        steps = _capped_steps(part_exact)
+        for _ in range(count):
+            exact = np.einsum("cj,cjk->ck", exact, steps)
+    return averages, exact
+
+
+def fold_to_horizon(tree: Distribution, horizon: int) -> Distribution:
+    if tree.keys.shape[1] <= horizon:
+        return tree
+    return cap_damage(tree, horizon)
+
+
 def average_damage(tree: dict[EventResult, Probability] | EventSet | list[EventSet]) -> float:
+    if isinstance(tree, Distribution):
+        return float(tree.probs @ tree.totals())
+
     map: dict[EventResult, Probability] = {}
     if isinstance(tree, dict):
         map = tree
@@ -173,6 +886,10 @@ def average_damage(tree: dict[EventResult, Probability] | EventSet | list[EventS
 def cumulative_damage_probabilities(
     tree: dict[EventResult, Probability] | EventSet | list[EventSet], damage_n
 ) -> dict[EventResult, Probability]:
+    if isinstance(tree, Distribution):
+        totals = tree.totals()
+        return [float(tree.probs[totals >= (ii + 1)].sum()) for ii in range(damage_n)]
+
     map: dict[EventResult, Probability] = {}
     if isinstance(tree, dict):
         map = tree
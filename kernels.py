@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+
+import dense
+import events as ev
+
+
+def binomial(amount: int, p: float) -> np.ndarray:
+    """
+    The chance of each number of successes, from 0 to amount, when amount rolls each succeed with chance p.
+    """
+    return np.array([math.comb(amount, k) * p**k * (1 - p) ** (amount - k) for k in range(amount + 1)])
+
+
+def bernoulli(stage: ev.Distribution) -> float | None:
+    """
+    The chance that a stage which results in at most one point of damage results in one,
+    or None when the stage can result in anything else.
+    """
+    if stage.deficit() > 1e-12:
+        # A pruned stage no longer says how likely the rest is, one that lost nothing only has rounding missing
+        return None
+    if stage.keys.shape[1] == 0:
+        return 0.0
+    if stage.keys.shape[1] > 1 or stage.keys.max() > 1:
+        return None
+    return float(stage.probs[stage.keys[:, 0] == 1].sum())
+
+
+def nothing(name: str = "") -> ev.Distribution:
+    return ev.Distribution(np.zeros((1, 0), dtype=np.int64), np.ones(1), name=name)
+
+
+def instance(size: int, name: str = "") -> ev.Distribution:
+    """
+    A single instance of damage of the size.
+    """
+    keys = np.zeros((1, size), dtype=np.int64)
+    keys[0, size - 1] = 1
+    return ev.Distribution(keys, np.ones(1), name=name)
+
+
+def thinned_damage(amounts: list[int], p: float, weights: list[float], name: str = "") -> ev.Distribution:
+    """
+    One of the amounts of damage, each as likely as its weight, with each point getting through with chance p.
+    The points that get through are a single instance of damage.
+    """
+    top = max(amounts)
+    probs = np.zeros(top + 1)
+    for amount, weight in zip(amounts, weights, strict=True):
+        probs[: amount + 1] += binomial(amount, p) * weight / sum(weights)
+    keys = np.zeros((top + 1, max(top, 1)), dtype=np.int64)
+    keys[np.arange(1, top + 1), np.arange(top)] = 1
+    possible = probs > 0
+    return ev.Distribution(keys[possible], probs[possible], name=name)
+
+
+def mixture(parts: list[ev.Distribution], weights: list[float], name: str = "") -> ev.Distribution:
+    """
+    One of the parts, each as likely as its weight.
+    """
+    width = max(1, *(p.keys.shape[1] for p in parts))
+    padded = []
+    for part, weight in zip(parts, weights, strict=True):
+        keys = np.zeros((len(part), width), dtype=np.int64)
+        keys[:, : part.keys.shape[1]] = part.keys
+        padded.append((keys, part.probs, weight / sum(weights)))
+    # Pruned parts pass on the most their full distributions could have had
+    support = None
+    if any(part.support is not None for part in parts):
+        estimates = [part.estimate() for part in parts]
+        support = ev.Estimate(
+            sum(e.outcomes for e in estimates),
+            np.max([e.top for e in estimates], axis=0),
+            max(e.instances for e in estimates),
+        )
+    return ev.Distribution(*dense.mix(padded), name=name, support=support)
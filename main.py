@@ -1,21 +1,42 @@
 from enum import unique
+import itertools
 import os
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 import icecream
 import string
 import datetime as dt
+import numpy as np
 import polars as pl
 
 from weapon import SimpleWeapon
 from outcomes import Dice
 from model import SimpleModel
 import roll as rl
+import montecarlo as mc
+import moments
+import store
 from actions import AttackOptions
 import actions
-from events import cap_damage, average_damage, cumulative_damage_probabilities
+from events import capped_damage_summary, capped_totals, add_capped_totals, at_least_damage, approximation_error
+from events import EngineOptions, DEFAULT_ENGINE, NUMPY_BACKEND
+import events as ev
 
 icecream.install()
 
+# The targets every weapon is computed against, and how many damage_k+ columns each gets
+SAVES = [ii for ii in range(7, 1, -1)]
+TOUGHNESSES = [ii for ii in range(2, 15)]
+# 7 is no invulnerable save
+INVULNERABLES = [7, 6, 5, 4]
+# 0 is no feel no pain
+FEEL_NO_PAINS = [0, 6, 5, 4]
+# Names in model.DAMAGE_MODIFIERS, each variant shares the distribution computed without any
+DAMAGE_MODIFIERS = [(), ("-1 Damage",), ("Halve Damage",)]
+WOUNDS = [ii for ii in range(1, 15)]
+DAMAGE_N = 9
+# The weapon name a unit's volley is written as
+VOLLEY_NAME = "Volley"
+
 
 @dataclass
 class DataLine:
@@ -28,6 +49,8 @@ class DataLine:
     armour_penetration: int
     damage: int | Dice
     modifiers: list[str]
+    # How many models of the unit have the weapon, None when the file does not say
+    models: int | None = None
 
     @staticmethod
     def parse_line(line: str) -> "DataLine":
@@ -85,59 +108,60 @@ class DataLine:
             tuple(modifiers),
         )
 
-    def compute_data(self, options: AttackOptions, weapon: SimpleWeapon) -> pl.DataFrame:
-        saves = [ii for ii in range(7, 1, -1)]
-        toughnesses = [ii for ii in range(2, 15)]
-        wounds = [ii for ii in range(1, 15)]
+    def compute_data(
+        self, options: AttackOptions, weapon: SimpleWeapon, engine: EngineOptions = DEFAULT_ENGINE
+    ) -> pl.DataFrame:
+        wounds = WOUNDS
 
         these_options = AttackOptions(options.half_range, options.cover, options.anti_active, weapon.modifiers)
+        # No wound cap looks past the largest one, so neither does the engine
+        engine = replace(engine, horizon=min(engine.horizon, max(wounds)))
 
         nxt = 5
-        total = len(saves) * len(toughnesses)
+        all_targets = targets()
+        total = len(all_targets)
+        computed = rl.damage_rolls.cache_info()["misses"]
         unique_possibilities = 0
         all_possibilities = 0
 
-        damage_n = 9
-        rows = {
-            "Toughness": [],
-            "Save": [],
-            "Wounds": [],
-        }
+        damage_n = DAMAGE_N
+        rows = target_rows()
+        rows["Wounds"] = []
         rows["damage_avg"] = []
         for ii in range(damage_n):
             rows[f"damage_{ii + 1}+"] = []
-
-        for ii, sv in enumerate(saves):
-            for jj, tough in enumerate(toughnesses):
-                number = ii * len(saves) + jj
-                target = SimpleModel(
-                    name=f"{sv}, {tough}",
-                    T=tough,
-                    S=sv,
-                    W=1,
-                    FNP=0,
-                )
+        # Pruned results say how much probability they lost, which also bounds every damage_k+ error
+        approximate = engine.epsilon > 0
+        if approximate:
+            rows["discarded"] = []
+            rows["damage_avg_error"] = []
+
+        # Targets that roll the same share the cached stages, so their summary is only worked out once
+        summaries: dict[tuple, tuple] = {}
+        for number, target in enumerate(all_targets):
+            key = tuple(target_arguments(weapon, target, options).items())
+            if key not in summaries:
                 start = dt.datetime.now()
-                damage, all_possibilities = rl.attack_roll(
-                    weapon.A,
-                    weapon.WS,
-                    weapon.S,
-                    target.T,
-                    target.S,
-                    weapon.AP,
-                    weapon.D,
-                    target.FNP,
-                    these_options,
-                    True,
-                )
-
-                outcomes = damage.outcomes()
-                unique_possibilities = len(outcomes)
+                damage = attack_tree(weapon, target, options, engine)
 
                 end = dt.datetime.now()
 
                 if number == 0:
                     diff = end - start
+                    unique_possibilities = damage.estimate().outcomes
+                    _, all_possibilities = rl.attack_roll(
+                        weapon.A,
+                        weapon.WS,
+                        weapon.S,
+                        target.T,
+                        None,
+                        weapon.AP,
+                        weapon.D,
+                        target.FNP,
+                        these_options,
+                        True,
+                        engine,
+                    )
                     total_outcomes = all_possibilities[1] ** all_possibilities[0]
                     print(
                         f"unique outcomes: {unique_possibilities:,}, "
@@ -146,25 +170,258 @@ class DataLine:
                     print(f"time per {diff} each of {total}, extimated {diff * total}")
                     print("[", end="", flush=True)
 
-                for cap in wounds:
-                    rows["Toughness"].append(tough)
-                    rows["Save"].append(sv)
-                    rows["Wounds"].append(cap)
-                    capped_outcomes = cap_damage(outcomes, cap)
-                    cumulative_damage_prob = cumulative_damage_probabilities(capped_outcomes, damage_n)
-                    for ii, p in enumerate(cumulative_damage_prob):
-                        rows[f"damage_{ii + 1}+"].append(p)
+                summary = capped_damage_summary(damage, wounds, damage_n)
+                if approximate:
+                    summary += approximation_error(damage, wounds)
+                summaries[key] = summary
+            summary = summaries[key]
+            averages, cumulative_damage_probs = summary[:2]
+            if approximate:
+                discarded, average_errors = summary[2:]
+            for kk, cap in enumerate(wounds):
+                add_target(rows, target)
+                rows["Wounds"].append(cap)
+                for ii in range(damage_n):
+                    rows[f"damage_{ii + 1}+"].append(float(cumulative_damage_probs[kk, ii]))
+
+                rows["damage_avg"].append(float(averages[kk]))
+                if approximate:
+                    rows["discarded"].append(discarded)
+                    rows["damage_avg_error"].append(float(average_errors[kk]))
+
+            if (100 * (number + 1)) / total > nxt:
+                print("=", end="", flush=True)
+                nxt += 5
+        print(f"] {rl.damage_rolls.cache_info()['misses'] - computed} distinct targets of {total}")
 
-                    rows["damage_avg"].append(average_damage(capped_outcomes))
+        return pl.DataFrame(rows)
 
-                if (100 * number) / total > nxt:
-                    print("=", end="", flush=True)
-                    nxt += 5
-        print("]")
+    def simulate_data(
+        self,
+        options: AttackOptions,
+        weapon: SimpleWeapon,
+        engine: EngineOptions = DEFAULT_ENGINE,
+        simulation: mc.SimulationOptions = mc.DEFAULT_SIMULATION,
+    ) -> pl.DataFrame:
+        """
+        The frame compute_data returns, estimated by simulation, with the standard error of every estimate.
+        """
+        engine = replace(engine, horizon=min(engine.horizon, max(WOUNDS)))
+
+        columns = ["damage_avg"] + [f"damage_{ii + 1}+" for ii in range(DAMAGE_N)]
+        rows = target_rows()
+        rows["Wounds"] = []
+        for column in columns:
+            rows[column] = []
+        for column in columns:
+            rows[f"{column}_se"] = []
+
+        # Targets that roll the same share their simulation, as they share their stages in compute_data
+        summaries: dict[tuple, tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+        print("[", end="", flush=True)
+        for target in targets():
+            arguments = target_arguments(weapon, target, options)
+            key = tuple(arguments.items())
+            if key not in summaries:
+                damage = mc.simulate(
+                    **arguments,
+                    engine=engine,
+                    simulation=simulation,
+                    # Each distinct target gets its own streams, so any one of them can be reproduced alone
+                    seed=(
+                        arguments["save_char"],
+                        arguments["strength_char"],
+                        arguments["target_toughness"],
+                        arguments["fnp_char"],
+                        DAMAGE_MODIFIERS.index(target.damage_modifiers),
+                    ),
+                )
+                summaries[key] = mc.simulated_damage_summary(damage, WOUNDS, DAMAGE_N, simulation.trials)
+            averages, at_least, average_errors, at_least_errors = summaries[key]
+            for kk, cap in enumerate(WOUNDS):
+                add_target(rows, target)
+                rows["Wounds"].append(cap)
+                rows["damage_avg"].append(float(averages[kk]))
+                rows["damage_avg_se"].append(float(average_errors[kk]))
+                for ii in range(DAMAGE_N):
+                    rows[f"damage_{ii + 1}+"].append(float(at_least[kk, ii]))
+                    rows[f"damage_{ii + 1}+_se"].append(float(at_least_errors[kk, ii]))
+        print("] simulated")
+
+        return pl.DataFrame(rows)
 
+    def moments_data(self, options: AttackOptions, weapon: SimpleWeapon) -> pl.DataFrame:
+        """
+        The mean and variance of the uncapped damage against every target, without computing any distribution.
+        """
+        rows = target_rows()
+        rows["damage_avg"] = []
+        rows["damage_var"] = []
+        for target in targets():
+            damage = moments.expected_damage(weapon, target, options)
+            add_target(rows, target)
+            rows["damage_avg"].append(damage.mean)
+            rows["damage_var"].append(damage.variance)
         return pl.DataFrame(rows)
 
 
+@dataclass(frozen=True)
+class TargetGrid:
+    """
+    The invulnerable saves, feel no pains and damage modifiers the targets are swept over, on top of every save and
+    toughness. Each sweep multiplies the rows of every output, so only the first of each is swept by default.
+    """
+
+    invulnerables: tuple[int, ...] = (INVULNERABLES[0],)
+    feel_no_pains: tuple[int, ...] = (FEEL_NO_PAINS[0],)
+    damage_modifiers: tuple[tuple[str, ...], ...] = (DAMAGE_MODIFIERS[0],)
+
+
+_grid = TargetGrid()
+
+
+def set_target_grid(grid: TargetGrid) -> TargetGrid:
+    """
+    Replaces the grid targets returns, returning the one it replaced.
+    """
+    global _grid
+    previous, _grid = _grid, grid
+    return previous
+
+
+def targets() -> list[SimpleModel]:
+    """
+    Every target of the grid a weapon is computed against, in the order of the output rows.
+    """
+    return [
+        SimpleModel(
+            name=f"{sv}, {tough}, {inv}, {fnp}, {damage_modifier_name(dm)}",
+            T=tough,
+            S=sv,
+            W=1,
+            FNP=fnp,
+            INV=inv,
+            damage_modifiers=dm,
+        )
+        for sv, tough, inv, fnp, dm in itertools.product(
+            SAVES, TOUGHNESSES, _grid.invulnerables, _grid.feel_no_pains, _grid.damage_modifiers
+        )
+    ]
+
+
+def target_arguments(weapon: SimpleWeapon, target: SimpleModel, options: AttackOptions) -> dict:
+    """
+    The arguments of the attack stages for the weapon against the target, normalised so that targets which roll the
+    same have the same ones.
+    """
+    arguments = {
+        "attack_char": weapon.A,
+        "weapon_skill": weapon.WS,
+        "strength_char": weapon.S,
+        "target_toughness": target.T,
+        "save_char": target.S,
+        "armour_penetration": weapon.AP,
+        "damage_char": weapon.D,
+        "fnp_char": target.FNP,
+        "options": AttackOptions(options.half_range, options.cover, options.anti_active, weapon.modifiers),
+        "invulnerable_save": target.INV,
+        "damage_modifiers": target.damage_modifiers,
+    }
+    rl.normalise_stage_arguments(arguments, actions.downstream_actions("attack"))
+    return arguments
+
+
+def attack_tree(
+    weapon: SimpleWeapon, target: SimpleModel, options: AttackOptions, engine: EngineOptions
+) -> ev.Compound:
+    # The attacks, hits and wounds are expanded once per toughness, and each save only thins them.
+    # The damage rolls are never expanded, the summaries take each cap of them in turn
+    return rl.saved_attack_tree(
+        weapon.A,
+        weapon.WS,
+        weapon.S,
+        target.T,
+        target.S,
+        weapon.AP,
+        target.INV,
+        weapon.D,
+        target.FNP,
+        AttackOptions(options.half_range, options.cover, options.anti_active, weapon.modifiers),
+        engine,
+        target.damage_modifiers,
+    )
+
+
+def volley_data(
+    weapons: list[tuple[SimpleWeapon, int]], options: AttackOptions, engine: EngineOptions = DEFAULT_ENGINE
+) -> pl.DataFrame:
+    """
+    The frame compute_data returns for every weapon of a unit firing together, each as many times as its count.
+    Each weapon is summarised on its own, from the same cached stages as its own table, and the summaries are
+    convolved, so the volley is never expanded as one tree.
+    """
+    wounds = WOUNDS
+    engine = replace(engine, horizon=min(engine.horizon, max(wounds)))
+
+    rows = target_rows()
+    rows["Wounds"] = []
+    rows["damage_avg"] = []
+    for ii in range(DAMAGE_N):
+        rows[f"damage_{ii + 1}+"] = []
+    approximate = engine.epsilon > 0
+    if approximate:
+        rows["discarded"] = []
+        rows["damage_avg_error"] = []
+
+    # As in compute_data, targets that roll the same share the totals
+    totals: dict[tuple, tuple] = {}
+    for target in targets():
+        parts = []
+        kept = 1.0
+        average_errors = np.zeros(len(wounds))
+        for weapon, count in weapons:
+            key = tuple(target_arguments(weapon, target, options).items())
+            if key not in totals:
+                damage = attack_tree(weapon, target, options, engine)
+                error = approximation_error(damage, wounds) if approximate else None
+                totals[key] = (capped_totals(damage, wounds, DAMAGE_N), error)
+            summary, error = totals[key]
+            parts.append((*summary, count))
+            if approximate:
+                discarded, errors = error
+                kept *= (1 - discarded) ** count
+                average_errors += count * errors
+        averages, exact = add_capped_totals(parts)
+        at_least = at_least_damage(exact)
+        for kk, cap in enumerate(wounds):
+            add_target(rows, target)
+            rows["Wounds"].append(cap)
+            for ii in range(DAMAGE_N):
+                rows[f"damage_{ii + 1}+"].append(float(at_least[kk, ii]))
+            rows["damage_avg"].append(float(averages[kk]))
+            if approximate:
+                rows["discarded"].append(1 - kept)
+                rows["damage_avg_error"].append(float(average_errors[kk]))
+
+    return pl.DataFrame(rows)
+
+
+def damage_modifier_name(damage_modifiers: tuple[str, ...]) -> str:
+    return ", ".join(damage_modifiers) if len(damage_modifiers) else "None"
+
+
+def target_rows() -> dict[str, list]:
+    return {"Toughness": [], "Save": [], "Invulnerable": [], "FNP": [], "Damage Modifier": []}
+
+
+def add_target(rows: dict[str, list], target: SimpleModel) -> None:
+    rows["Toughness"].append(target.T)
+    rows["Save"].append(target.S)
+    rows["Invulnerable"].append(target.INV)
+    rows["FNP"].append(target.FNP)
+    rows["Damage Modifier"].append(damage_modifier_name(target.damage_modifiers))
+
+
 @dataclass
 class DataFile:
     filename: str
@@ -173,66 +430,87 @@ class DataFile:
     def read(self) -> None:
         with open(self.filename, "r") as fle:
             ii = 0
+            # An optional Models column, in any place, says how many models have each weapon.
+            # Alternative profiles of one weapon, such as frag and krak, are left out of volleys with a 0 or empty cell
+            models_column = None
             try:
                 for ii, line in enumerate(fle):
                     if ii == 0:
+                        header = [h.strip().lower() for h in line.split(",")]
+                        if "models" in header:
+                            models_column = header.index("models")
                         continue
                     stripped_line = line.strip()
                     if len(stripped_line) == 0:
                         continue
-                    self.lines.append(DataLine.parse_line(stripped_line))
+                    models = None
+                    if models_column is not None:
+                        parts = stripped_line.split(",")
+                        if len(parts) <= models_column:
+                            raise ValueError(f"Line has {len(parts)} columns, so no Models column {models_column + 1}")
+                        cell = parts.pop(models_column).strip()
+                        if not cell.isdigit() and len(cell) > 0:
+                            raise ValueError(f"Models must be a count of models, not {cell!r}")
+                        models = int(cell or 0)
+                        stripped_line = ",".join(parts)
+                    data_line = DataLine.parse_line(stripped_line)
+                    data_line.models = models
+                    self.lines.append(data_line)
             except Exception:
                 print(f"Error in {self.filename}:{ii}")
                 raise
 
+    def units(self) -> dict[str, list[DataLine]]:
+        units: dict[str, list[DataLine]] = {}
+        for line in self.lines:
+            units.setdefault(line.unit, []).append(line)
+        return units
+
+    def volleys(self) -> dict[str, list[tuple[DataLine, int]]]:
+        """
+        The ranged weapons each unit fires together, and how many models fire each, for the units whose lines all
+        say how many models have them.
+        """
+        volleys = {}
+        for unit, lines in self.units().items():
+            counts = [line.models for line in lines]
+            if None in counts:
+                continue
+            fired = [(line, models) for line, models in zip(lines, counts, strict=True) if line.rng > 0 and models]
+            if len(fired) > 0:
+                volleys[unit] = fired
+        return volleys
+
 
 if __name__ == "__main__":
-    modifier_funcs = [
-        actions.torrent,
-        actions.reroll_hit_1,
-        actions.all_hits_critical,
-        actions.rapid_fire(1),
-        actions.rapid_fire(2),
-        actions.rapid_fire(3),
-        actions.rapid_fire(5),
-        actions.rapid_fire(6),
-        actions.rapid_fire(Dice(1, 3)),
-        actions.critical_hits(4),
-        actions.critical_hits(5),
-        actions.sustained_hits(1),
-        actions.sustained_hits(2),
-        actions.sustained_hits(Dice(1, 3, 0)),
-        actions.lethal_hits,
-        actions.twin_linked,
-        actions.melta(2),
-        actions.melta(4),
-        actions.precision,
-        actions.blast,
-        actions.pistol,
-        actions.hazardous,
-        actions.ignores_cover,
-        actions.indirect_fire,
-        actions.anti("character", 4),
-        actions.anti("fly", 4),
-        actions.anti("fly", 2),
-        actions.anti("vehicle", 2),
-        actions.anti("infantry", 4),
-        actions.devastating_wounds,
-        actions.bypass_wound,
-        actions.bypass_save,
-        actions.mortal_wounds,
-        actions.all_wounds_critical,
-        actions.one_shot,
-        actions.assult,
-        actions.heavy,
-        actions.lance,
-        actions.psychic,
-    ]
-    modifier_map = {func.name.lower().replace("_", " "): func for func in modifier_funcs}
+    modifier_map = actions.KeywordMap()
 
     key_errors = []
 
     options = AttackOptions(False, False, False, tuple())
+    # Set to drop outcomes less likely than this, the output then reports the error that can cause
+    engine = EngineOptions(NUMPY_BACKEND, epsilon=float(os.environ.get("PRUNE_EPSILON", 0)))
+    # Set to share stage results between runs, and between runs going at the same time
+    cache_dir = os.environ.get("STAGE_CACHE_DIR")
+    if cache_dir is not None:
+        store.configure(cache_dir)
+    # Weapons whose exact distribution is estimated to have more outcomes than this are simulated instead
+    ev.set_budget(ev.Budget(max_outcomes=int(os.environ.get("EXACT_MAX_OUTCOMES", ev.Budget.max_outcomes))))
+    # Set to only write the mean and variance of the uncapped damage, which takes no time at all
+    moments_only = os.environ.get("MOMENTS_ONLY") is not None
+    simulation = mc.SimulationOptions(trials=int(os.environ.get("SIMULATION_TRIALS", mc.DEFAULT_SIMULATION.trials)))
+    # Set to also sweep the targets over every invulnerable save, feel no pain or damage modifier, which multiplies the
+    # rows of every output by the number of them
+    grid = TargetGrid()
+    if os.environ.get("INVULNERABLE_SWEEP") is not None:
+        grid = replace(grid, invulnerables=tuple(INVULNERABLES))
+    if os.environ.get("FEEL_NO_PAIN_SWEEP") is not None:
+        grid = replace(grid, feel_no_pains=tuple(FEEL_NO_PAINS))
+    if os.environ.get("DAMAGE_MODIFIER_SWEEP") is not None:
+        grid = replace(grid, damage_modifiers=tuple(DAMAGE_MODIFIERS))
+    set_target_grid(grid)
+    # Set to also write what all the ranged weapons of each unit do firing together, as a weapon named VOLLEY_NAME
+    volley = os.environ.get("VOLLEY") is not None
     input = "input"
     output = "docs"
     for fle in os.listdir(input):
@@ -251,6 +529,12 @@ if __name__ == "__main__":
                     os.makedirs(os.path.join(output, output_folder))
                 output_filename = os.path.join(output_folder, line.weapon_name)
 
+                if moments_only:
+                    line.moments_data(options, weapon).write_csv(
+                        os.path.join(output, f"{output_filename}.moments.csv"), float_precision=4
+                    )
+                    continue
+
                 if os.path.exists(os.path.join(output, f"{output_filename}.csv")):
                     df = pl.read_csv(
                         os.path.join(output, f"{output_filename}.csv"),
@@ -259,7 +543,11 @@ if __name__ == "__main__":
                 else:
                     start = dt.datetime.now()
                     try:
-                        df = line.compute_data(options, weapon)
+                        try:
+                            df = line.compute_data(options, weapon, engine)
+                        except rl.ProbabilityTreeTooLargeError as e:
+                            print(f"Simulating due to huge probability tree: {e}")
+                            df = line.simulate_data(options, weapon, engine, simulation)
                         df.write_csv(
                             os.path.join(output, f"{output_filename}.csv"),
                             float_precision=4,
@@ -268,9 +556,6 @@ if __name__ == "__main__":
                     except KeyError as e:
                         key_errors.append(e)
                         continue
-                    except rl.ProbabilityTreeTooLargeError as e:
-                        print(f"Skipping due to huge probability tree: {e}")
-                        continue
                     finally:
                         end = dt.datetime.now()
                         print(f" {end - start}")
@@ -279,5 +564,28 @@ if __name__ == "__main__":
                     fle.write(weapon.stat_line() + "\n")
                     fle.write(weapon.keywords() + "\n")
 
+            if volley:
+                for unit, fired in datafile.volleys().items():
+                    print(f"Volley {group_name} {unit}")
+                    if not os.path.exists(os.path.join(output, group_name, unit)):
+                        os.makedirs(os.path.join(output, group_name, unit))
+                    output_filename = os.path.join(group_name, unit, VOLLEY_NAME)
+                    try:
+                        weapons = [(line.create_weapon(modifier_map), models) for line, models in fired]
+                        start = dt.datetime.now()
+                        volley_data(weapons, options, engine).write_csv(
+                            os.path.join(output, f"{output_filename}.csv"), float_precision=4
+                        )
+                        print(f" {dt.datetime.now() - start}")
+                    except KeyError as e:
+                        key_errors.append(e)
+                        continue
+                    except rl.ProbabilityTreeTooLargeError as e:
+                        print(f"Skipping volley due to huge probability tree: {e}")
+                        continue
+                    with open(os.path.join(output, f"{output_filename}.weapon.txt"), "w") as fle:
+                        fle.write(", ".join(f"{models} x {weapon.name}" for weapon, models in weapons) + "\n")
+                        fle.write("\n")
+
     for e in key_errors:
         print(e)
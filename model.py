@@ -1,6 +1,26 @@
+from collections.abc import Callable
 from dataclasses import dataclass
-from outcomes import Outcome
-import outcomes as oc
+
+
+def minus_one_damage(damage: int) -> int:
+    return max(damage - 1, 1)
+
+
+def halve_damage(damage: int) -> int:
+    return (damage + 1) // 2
+
+
+# The damage modifiers a target can have, each changing the damage of one attack before any feel no pain
+DAMAGE_MODIFIERS: dict[str, Callable[[int], int]] = {
+    "-1 Damage": minus_one_damage,
+    "Halve Damage": halve_damage,
+}
+
+
+def modify_damage(damage_modifiers: tuple[str, ...], damage: int) -> int:
+    for name in damage_modifiers:
+        damage = DAMAGE_MODIFIERS[name](damage)
+    return damage
 
 
 @dataclass(frozen=True)
@@ -10,9 +30,13 @@ class SimpleModel:
     S: int
     W: int
     FNP: int
+    # 7 is no invulnerable save
+    INV: int = 7
+    # Names in DAMAGE_MODIFIERS, applied in order
+    damage_modifiers: tuple[str, ...] = ()
 
-    def damage_modifier(self, damage: int) -> list[Outcome]:
-        return [Outcome(damage, -1, oc.success(), False, False)]
+    def damage_modifier(self, damage: int) -> int:
+        return modify_damage(self.damage_modifiers, damage)
 
     def __str__(self) -> str:
         return f"{self.name}: T {self.T}, S {self.S}+, W {self.W}"
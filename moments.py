@@ -0,0 +1,141 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+import actions
+import roll as rl
+from actions import AttackOptions
+from model import SimpleModel, modify_damage
+from outcomes import Outcome
+from weapon import SimpleWeapon
+
+
+@dataclass(frozen=True)
+class Moments:
+    mean: float
+    variance: float
+
+
+# The mean and the mean square of the damage a roll goes on to do
+Raw = tuple[float, float]
+
+NOTHING: Raw = (0.0, 0.0)
+
+
+def _mix(outcomes: list[Outcome], parts: list[Raw]) -> Raw:
+    total = sum(o.weight for o in outcomes)
+    return (
+        sum(o.weight * mean for o, (mean, _) in zip(outcomes, parts, strict=True)) / total,
+        sum(o.weight * square for o, (_, square) in zip(outcomes, parts, strict=True)) / total,
+    )
+
+
+def _repeat(part: Raw, count: int) -> Raw:
+    # The sum of count independent rolls, whose cross terms are the products of their means
+    mean, square = part
+    return count * mean, count * square + count * (count - 1) * mean**2
+
+
+class _Stages:
+    """
+    The moments of the damage each stage in roll goes on to do, following the same outcomes and branches.
+    Damage is a sum over independent rolls, so the moments of a stage only need the moments of the next one.
+    """
+
+    def __init__(self, arguments: dict[str, Any]):
+        self.arguments = arguments
+        self.options: AttackOptions = arguments["options"]
+
+    def damage(self) -> Raw:
+        fnps = actions.feel_no_pain(self.options.modifiers, self.arguments["fnp_char"], self.options)
+        through = sum(o.weight for o in fnps if not o.success) / sum(o.weight for o in fnps)
+        damages = actions.damage(self.options.modifiers, self.arguments["damage_char"], self.options)
+        values = [modify_damage(self.arguments["damage_modifiers"], d.value) for d in damages]
+        # The points that get through are binomial
+        return _mix(damages, [(v * through, v * through * (1 - through) + (v * through) ** 2) for v in values])
+
+    def save(self, reroll: bool) -> Raw:
+        saves = actions.save(
+            self.options.modifiers, self.arguments["save_char"], self.arguments["armour_penetration"], self.options
+        )
+        parts = []
+        for save in saves:
+            if save.success:
+                parts.append(NOTHING)
+            elif save.reroll and reroll:
+                parts.append(self.save(False))
+            else:
+                parts.append(self.damage())
+        return _mix(saves, parts)
+
+    def wound(self, reroll: bool) -> Raw:
+        wounds = actions.wound(
+            self.options.modifiers, self.arguments["strength_char"], self.arguments["target_toughness"], self.options
+        )
+        parts = []
+        for wound in wounds:
+            if wound.bypass_next:
+                parts.append(self.damage())
+            elif wound.success:
+                parts.append(self.save(True))
+            elif wound.reroll and reroll:
+                parts.append(self.wound(False))
+            else:
+                parts.append(NOTHING)
+        return _mix(wounds, parts)
+
+    def hit(self, reroll: bool) -> Raw:
+        hits = actions.hit(self.options.modifiers, self.arguments["weapon_skill"], self.options)
+        parts = []
+        for hit in hits:
+            if hit.bypass_next:
+                parts.append(_repeat(self.save(True), hit.value))
+            elif hit.success:
+                parts.append(_repeat(self.wound(True), hit.value))
+            elif hit.reroll and reroll:
+                parts.append(self.hit(False))
+            else:
+                parts.append(NOTHING)
+        return _mix(hits, parts)
+
+    def attack(self, reroll: bool) -> Raw:
+        attacks = actions.attack(self.options.modifiers, self.arguments["attack_char"], self.options)
+        parts = []
+        for attack in attacks:
+            if attack.bypass_next:
+                parts.append(_repeat(self.wound(True), attack.value))
+            elif attack.success:
+                parts.append(_repeat(self.hit(True), attack.value))
+            elif attack.reroll and reroll:
+                parts.append(self.attack(False))
+            else:
+                parts.append(NOTHING)
+        return _mix(attacks, parts)
+
+
+@lru_cache(maxsize=10_000)
+def _attack_moments(arguments: tuple[tuple[str, Any], ...]) -> Moments:
+    mean, square = _Stages(dict(arguments)).attack(True)
+    return Moments(mean, max(square - mean**2, 0.0))
+
+
+def expected_damage(weapon: SimpleWeapon, target: SimpleModel, options: AttackOptions) -> Moments:
+    """
+    The mean and variance of the uncapped damage of the weapon against the target, without expanding any distribution.
+    """
+    arguments = {
+        "attack_char": weapon.A,
+        "weapon_skill": weapon.WS,
+        "strength_char": weapon.S,
+        "target_toughness": target.T,
+        "save_char": target.S,
+        "armour_penetration": weapon.AP,
+        "damage_char": weapon.D,
+        "fnp_char": target.FNP,
+        "invulnerable_save": target.INV,
+        "damage_modifiers": target.damage_modifiers,
+        "options": AttackOptions(options.half_range, options.cover, options.anti_active, weapon.modifiers),
+    }
+    # Targets that roll the same share their moments
+    rl.normalise_stage_arguments(arguments, actions.downstream_actions("attack"))
+    return _attack_moments(tuple(arguments.items()))
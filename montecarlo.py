@@ -0,0 +1,208 @@
+from dataclasses import dataclass
+from typing import Any
+from collections.abc import Callable, Iterable
+
+import numpy as np
+
+import actions
+import dense
+import events as ev
+import roll as rl
+from actions import AttackOptions
+from model import modify_damage
+from outcomes import Dice, Outcome
+
+
+@dataclass(frozen=True)
+class SimulationOptions:
+    trials: int = 1_000_000
+    # Trials drawn together, which bounds the memory a simulation holds at once
+    chunk_size: int = 100_000
+    seed: int = 0
+
+
+DEFAULT_SIMULATION = SimulationOptions()
+
+# The trial each damage instance belongs to, and its size
+Instances = tuple[np.ndarray, np.ndarray]
+
+
+def _none() -> Instances:
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+
+def _join(parts: list[Instances]) -> Instances:
+    if len(parts) == 0:
+        return _none()
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+
+class _Trials:
+    """
+    Rolls every stage for a batch of trials at once, following the same outcomes and branches as the stages in roll.
+    Each stage takes the trial of every roll it makes, and returns the damage instances those rolls cause.
+    """
+
+    def __init__(self, arguments: dict[str, Any], horizon: int, rng: np.random.Generator):
+        self.arguments = arguments
+        self.options: AttackOptions = arguments["options"]
+        self.horizon = min(horizon, ev.max_damage)
+        self.rng = rng
+
+    def _split(self, outcomes: list[Outcome], owners: np.ndarray) -> Iterable[tuple[Outcome, np.ndarray]]:
+        weights = np.array([o.weight for o in outcomes], dtype=np.float64)
+        chosen = self.rng.choice(len(outcomes), size=len(owners), p=weights / weights.sum())
+        for ii, outcome in enumerate(outcomes):
+            rolled = owners[chosen == ii]
+            if len(rolled):
+                yield outcome, rolled
+
+    def feel_no_pain(self, owners: np.ndarray) -> np.ndarray:
+        """
+        Whether each point of damage gets through.
+        """
+        fnps = actions.feel_no_pain(self.options.modifiers, self.arguments["fnp_char"], self.options)
+        weights = np.array([o.weight for o in fnps], dtype=np.float64)
+        through = np.array([not fnp.success for fnp in fnps])
+        return through[self.rng.choice(len(fnps), size=len(owners), p=weights / weights.sum())]
+
+    def damage(self, owners: np.ndarray) -> Instances:
+        parts = []
+        for damage, rolled in self._split(
+            actions.damage(self.options.modifiers, self.arguments["damage_char"], self.options), owners
+        ):
+            value = modify_damage(self.arguments["damage_modifiers"], damage.value)
+            # Each point passes the feel no pain on its own, the points that get through are one instance
+            instance = np.repeat(np.arange(len(rolled)), value)
+            sizes = np.bincount(instance, weights=self.feel_no_pain(instance), minlength=len(rolled)).astype(np.int64)
+            hit = sizes > 0
+            parts.append((rolled[hit], np.minimum(sizes[hit], self.horizon)))
+        return _join(parts)
+
+    def save(self, owners: np.ndarray, reroll: bool) -> Instances:
+        parts = []
+        saves = actions.save(
+            self.options.modifiers, self.arguments["save_char"], self.arguments["armour_penetration"], self.options
+        )
+        for save, rolled in self._split(saves, owners):
+            if save.success:
+                continue
+            elif save.reroll and reroll:
+                parts.append(self.save(rolled, False))
+            else:
+                parts.append(self.damage(rolled))
+        return _join(parts)
+
+    def wound(self, owners: np.ndarray, reroll: bool) -> Instances:
+        parts = []
+        wounds = actions.wound(
+            self.options.modifiers, self.arguments["strength_char"], self.arguments["target_toughness"], self.options
+        )
+        for wound, rolled in self._split(wounds, owners):
+            if wound.bypass_next:
+                parts.append(self.damage(rolled))
+            elif wound.success:
+                parts.append(self.save(rolled, True))
+            elif wound.reroll and reroll:
+                parts.append(self.wound(rolled, False))
+        return _join(parts)
+
+    def hit(self, owners: np.ndarray, reroll: bool) -> Instances:
+        parts = []
+        for hit, rolled in self._split(
+            actions.hit(self.options.modifiers, self.arguments["weapon_skill"], self.options), owners
+        ):
+            if hit.bypass_next:
+                parts.append(self.save(np.repeat(rolled, hit.value), True))
+            elif hit.success:
+                parts.append(self.wound(np.repeat(rolled, hit.value), True))
+            elif hit.reroll and reroll:
+                parts.append(self.hit(rolled, False))
+        return _join(parts)
+
+    def attack(self, owners: np.ndarray, reroll: bool) -> Instances:
+        parts = []
+        for attack, rolled in self._split(
+            actions.attack(self.options.modifiers, self.arguments["attack_char"], self.options), owners
+        ):
+            if attack.bypass_next:
+                parts.append(self.wound(np.repeat(rolled, attack.value), True))
+            elif attack.success:
+                parts.append(self.hit(np.repeat(rolled, attack.value), True))
+            elif attack.reroll and reroll:
+                parts.append(self.attack(rolled, False))
+        return _join(parts)
+
+
+def _simulate_chunk(
+    task: tuple[dict[str, Any], int, np.random.SeedSequence, int],
+) -> tuple[np.ndarray, np.ndarray]:
+    arguments, horizon, seed, size = task
+    trials = _Trials(arguments, horizon, np.random.default_rng(seed))
+    owners, sizes = trials.attack(np.arange(size, dtype=np.int64), True)
+    keys = np.bincount(owners * trials.horizon + sizes - 1, minlength=size * trials.horizon)
+    return dense.merge(keys.reshape(size, trials.horizon), np.ones(size))
+
+
+def simulate(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    save_char: int,
+    armour_penetration: int,
+    damage_char: int | Dice,
+    fnp_char: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+    simulation: SimulationOptions = DEFAULT_SIMULATION,
+    seed: tuple[int, ...] = (),
+    mapper: Callable = map,
+    invulnerable_save: int = 7,
+    damage_modifiers: tuple[str, ...] = (),
+) -> ev.Distribution:
+    """
+    The same distribution attack_roll computes, estimated from the frequencies of simulation.trials trials.
+    Every chunk of trials has its own stream spawned from simulation.seed and seed, so the result only depends
+    on those and the chunk size, and the chunks can be run in parallel by passing an executor's map as mapper.
+    """
+    arguments = {
+        "attack_char": attack_char,
+        "weapon_skill": weapon_skill,
+        "strength_char": strength_char,
+        "target_toughness": target_toughness,
+        "save_char": save_char,
+        "armour_penetration": armour_penetration,
+        "damage_char": damage_char,
+        "fnp_char": fnp_char,
+        "options": options,
+        "invulnerable_save": invulnerable_save,
+        "damage_modifiers": damage_modifiers,
+    }
+    # The actions see the same characteristics they do in the exact engine
+    rl.normalise_stage_arguments(arguments, actions.downstream_actions("attack"))
+
+    sizes = [simulation.chunk_size] * (simulation.trials // simulation.chunk_size)
+    if simulation.trials % simulation.chunk_size:
+        sizes.append(simulation.trials % simulation.chunk_size)
+    streams = np.random.SeedSequence([simulation.seed, *seed]).spawn(len(sizes))
+    chunks = list(
+        mapper(_simulate_chunk, [(arguments, engine.horizon, s, n) for s, n in zip(streams, sizes, strict=True)])
+    )
+
+    keys, counts = dense.merge(np.concatenate([k for k, _ in chunks]), np.concatenate([c for _, c in chunks]))
+    return ev.Distribution(keys, counts / simulation.trials, name="MC")
+
+
+def simulated_damage_summary(
+    tree: ev.Distribution, caps: list[int], damage_n: int, trials: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    capped_damage_summary of a simulated distribution, followed by the standard errors of the averages
+    and of the chance of at least 1..damage_n damage.
+    """
+    averages, at_least = ev.capped_damage_summary(tree, caps, damage_n)
+    sizes = np.arange(1, tree.keys.shape[1] + 1)[:, None]
+    totals = tree.keys.astype(np.int64) @ np.minimum(sizes, np.array(caps)[None, :])
+    variances = np.maximum(tree.probs @ totals**2 - averages**2, 0)
+    return averages, at_least, np.sqrt(variances / trials), np.sqrt(at_least * (1 - at_least) / trials)
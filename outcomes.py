@@ -1,18 +1,22 @@
 from enum import Enum
 from typing import TypeVar
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+import numpy as np
 
 T = TypeVar("T")
 
 
-def collect(items: list[T]) -> dict[T, int]:
+def collect(items: list[T], weights: list[float] | None = None) -> dict[T, float]:
     collection = {}
-    for item in items:
+    for ii, item in enumerate(items):
+        weight = 1 if weights is None else weights[ii]
         if item not in collection:
-            collection[item] = 1
+            collection[item] = weight
         else:
-            collection[item] += 1
+            collection[item] += weight
     return collection
 
 
@@ -59,6 +63,8 @@ class Outcome:
     success: Success
     bypass_next: bool
     reroll: bool
+    # How many equally likely rolls lead to this outcome
+    weight: float = 1
 
     def __lt__(self, other) -> bool:
         if self.value < other.value:
@@ -77,31 +83,53 @@ class Outcome:
             "B" if self.bypass_next else "-",
             "R" if self.reroll else "-",
         ]
-        return f"O({self.value} [{self.roll_value}], {''.join(values)})"
+        weight = f" x{self.weight:g}" if self.weight != 1 else ""
+        return f"O({self.value} [{self.roll_value}], {''.join(values)}{weight})"
+
+
+def merge(outcomes: list[Outcome]) -> list[Outcome]:
+    """
+    Combines the outcomes that only differ in the roll that led to them, adding up their weights.
+    """
+    collection = collect([replace(o, roll_value=-1, weight=1) for o in outcomes], [o.weight for o in outcomes])
+    return [replace(o, weight=weight) for o, weight in collection.items()]
 
 
+@dataclass(frozen=True)
 class Dice:
-    def __init__(self, number: int, sides: int, addition: int = 0):
-        self.number = number
-        self.sides = sides
-        self.addition = addition
+    """
+    number dice with sides sides, plus addition. others holds any further (number, sides) groups,
+    as in D6+D3, and equal dice are normalised to equal groups so they hash and compare equal.
+    """
+
+    number: int
+    sides: int
+    addition: int = 0
+    others: tuple[tuple[int, int], ...] = ()
+
+    def __post_init__(self):
+        counts: dict[int, int] = {}
+        for number, sides in ((self.number, self.sides), *self.others):
+            counts[sides] = counts.get(sides, 0) + number
+        groups = sorted(counts.items(), reverse=True)
+        object.__setattr__(self, "sides", groups[0][0])
+        object.__setattr__(self, "number", groups[0][1])
+        object.__setattr__(self, "others", tuple((number, sides) for sides, number in groups[1:]))
+
+    def groups(self) -> tuple[tuple[int, int], ...]:
+        return ((self.number, self.sides), *self.others)
+
+    def distribution(self) -> tuple[tuple[int, int], ...]:
+        """
+        Each total the dice can roll and the number of ways to roll it.
+        """
+        return _dice_distribution(self)
 
     def __call__(self) -> list[Outcome]:
-        rolls = [ii for ii in range(1, self.sides + 1)]
-        for _ in range(1, self.number):
-            new_rolls = []
-            for r in rolls:
-                new_rolls.extend([r + jj for jj in range(1, self.sides + 1)])
-            rolls = new_rolls
-
-        return [Outcome(1, ii + self.addition, success(), False, False) for ii in rolls]
+        return list(_dice_outcomes(self))
 
     def __str__(self):
-        if self.number > 1:
-            prefix = str(self.number)
-        else:
-            prefix = ""
-        results = f"{prefix}d{self.sides}"
+        results = "+".join(f"{number if number > 1 else ''}d{sides}" for number, sides in self.groups())
         if self.addition > 0:
             return f"{results}+{self.addition}"
         else:
@@ -109,19 +137,29 @@ class Dice:
 
     @staticmethod
     def from_str(s: str) -> "Dice":
-        parts = [p.strip() for p in s.split("+")]
-        assert (len(parts) >= 1) and (len(parts) <= 2)
-        if len(parts) > 1:
-            addition = int(parts[1])
-        else:
-            addition = 0
-
-        parts = [p.strip() for p in parts[0].split("d")]
-        assert (len(parts) >= 1) and (len(parts) <= 2)
-        if len(parts[0]) > 0:
-            number = int(parts[0])
-            sides = int(parts[1])
-        else:
-            number = 1
-            sides = int(parts[1])
-        return Dice(number, sides, addition)
+        groups = []
+        addition = 0
+        for part in [p.strip() for p in s.lower().split("+")]:
+            if "d" in part:
+                number, sides = [p.strip() for p in part.split("d")]
+                groups.append((int(number) if len(number) else 1, int(sides)))
+            else:
+                addition += int(part)
+        assert len(groups) >= 1
+        return Dice(*groups[0], addition, tuple(groups[1:]))
+
+
+@lru_cache(maxsize=None)
+def _dice_distribution(dice: Dice) -> tuple[tuple[int, int], ...]:
+    # ways[ii] is the number of ways to roll a total of ii, built up one die at a time
+    ways = np.ones(1, dtype=np.int64)
+    for number, sides in dice.groups():
+        for _ in range(number):
+            ways = np.convolve(ways, np.concatenate(([0], np.ones(sides, dtype=np.int64))))
+    return tuple((total + dice.addition, int(w)) for total, w in enumerate(ways) if w > 0)
+
+
+@lru_cache(maxsize=None)
+def _dice_outcomes(dice: Dice) -> tuple[Outcome, ...]:
+    # One outcome per total, weighted by the number of ways to roll it
+    return tuple(Outcome(1, total, success(), False, False, weight) for total, weight in dice.distribution())
@@ -1,58 +1,327 @@
+from collections import OrderedDict, defaultdict
+from dataclasses import replace
 from typing import Any
 from events import EventSet, Probability, collapse_tree
-from functools import lru_cache
+from functools import wraps
+import inspect
+import sys
+
+import numpy as np
 
 import events as ev
+import kernels
+import unit
+import store
 import actions
 from actions import AttackOptions, Modifier
 from outcomes import Dice
 
-from model import SimpleModel
+from model import SimpleModel, modify_damage
 from weapon import SimpleWeapon
 
-LRU_CACHEMAX_MAX = 1_000
+# Stage results are kept until their estimated sizes add up to this, across all stages together
+STAGE_CACHE_MAX_BYTES = 256 << 20
+
+# Roughly what an entry costs besides its arrays: the key, the Distribution object and the bookkeeping
+ENTRY_OVERHEAD_BYTES = 1_000
+DICT_OUTCOME_BYTES = 300
 
 
-class ProbabilityTreeTooLargeError(Exception):
-    pass
+# Raised while expanding, so it lives with the engine
+ProbabilityTreeTooLargeError = ev.ProbabilityTreeTooLargeError
 
 
-def return_res(results, name):
+def return_res(results, name, engine: ev.EngineOptions = ev.DEFAULT_ENGINE, weights: list[float] | None = None):
     # print(f'{name}{len(results)},', end='', flush=True)
-    return ev.collapse_tree(results, name=name)
+    return ev.collapse_tree(results, name=name, engine=engine, weights=weights)
+
+
+# Strength and toughness pairs that need a 2+, 3+, 4+, 5+ and 6+ to wound
+_WOUND_PAIRS = {2: (3, 1), 3: (2, 1), 4: (1, 1), 5: (2, 3), 6: (1, 2)}
+
+
+def wound_threshold(strength_char: int, target_toughness: int) -> int:
+    if strength_char > 2 * target_toughness:
+        return 2
+    elif strength_char > target_toughness:
+        return 3
+    elif strength_char == target_toughness:
+        return 4
+    elif 2 * strength_char > target_toughness:
+        return 5
+    return 6
+
+
+def effective_wound(strength_char: int, target_toughness: int) -> tuple[int, int]:
+    """
+    The representative strength and toughness that need the same roll to wound.
+    The wound action and its modifiers only see strength and toughness through this roll.
+    """
+    return _WOUND_PAIRS[wound_threshold(strength_char, target_toughness)]
+
+
+def effective_save(save_char: int, armour_penetration: int, invulnerable_save: int = 7) -> tuple[int, int]:
+    """
+    The save after armour penetration, or the invulnerable save when that is better, with no penetration left to apply.
+    Anything at or above 7 can not be saved and anything at or below 1 always is.
+    """
+    return min(max(save_char - armour_penetration, 1), invulnerable_save, 7), 0
+
+
+def effective_weapon_skill(weapon_skill: int) -> int:
+    # A 1 always misses and a 6 always hits
+    return min(max(weapon_skill, 2), 6)
+
+
+def effective_feel_no_pain(fnp_char: int) -> int:
+    # A 7+ feel no pain never passes, which is the same as not having one
+    if fnp_char >= 7:
+        return 0
+    return max(fnp_char, 0)
+
+
+def normalise_stage_arguments(arguments: dict[str, Any], scope: tuple[str, ...]) -> None:
+    """
+    Replaces the characteristics in arguments with the effective ones, and the options with those
+    the actions in scope can see, so that inputs which roll the same share a cache entry.
+    """
+    if "options" in arguments:
+        arguments["options"] = arguments["options"].scoped(scope)
+    if arguments.get("save_char", 0) is None:
+        # Stopped at the save step, so nothing from the save on is rolled
+        arguments["armour_penetration"] = 0
+        arguments["damage_char"] = None
+        arguments["fnp_char"] = None
+    if "strength_char" in arguments:
+        arguments["strength_char"], arguments["target_toughness"] = effective_wound(
+            arguments["strength_char"], arguments["target_toughness"]
+        )
+    if "invulnerable_save" in arguments:
+        arguments["save_char"], arguments["armour_penetration"] = effective_save(
+            arguments["save_char"], arguments["armour_penetration"], arguments["invulnerable_save"]
+        )
+        arguments["invulnerable_save"] = 7
+    elif arguments.get("save_char") is not None:
+        arguments["save_char"], arguments["armour_penetration"] = effective_save(
+            arguments["save_char"], arguments["armour_penetration"]
+        )
+    if "weapon_skill" in arguments:
+        arguments["weapon_skill"] = effective_weapon_skill(arguments["weapon_skill"])
+    if arguments.get("fnp_char") is not None:
+        arguments["fnp_char"] = effective_feel_no_pain(arguments["fnp_char"])
+
+
+def entry_bytes(value: Any) -> int:
+    """
+    The approximate memory a cached stage result holds on to.
+    """
+    if isinstance(value, ev.Distribution):
+        return value.keys.nbytes + value.probs.nbytes + ENTRY_OVERHEAD_BYTES
+    if isinstance(value, tuple):
+        return sum(entry_bytes(v) for v in value)
+    if isinstance(value, dict):
+        # Outcome maps of the dict backend, and roll counts, costed as if every item were an outcome
+        return len(value) * DICT_OUTCOME_BYTES + ENTRY_OVERHEAD_BYTES
+    return sys.getsizeof(value)
+
+
+class StageCache:
+    """
+    A least recently used cache shared by all stages, bounded by the estimated bytes of the entries
+    rather than by their count, so a few huge distributions can not grow it without limit and
+    many small ones are not evicted needlessly.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries: OrderedDict[tuple[str, tuple[Any, ...]], tuple[Any, int]] = OrderedDict()
+        self.stats: defaultdict[str, dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0}
+        )
+
+    def get(self, stage: str, args: tuple[Any, ...], default: Any = None) -> Any:
+        key = (stage, args)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats[stage]["misses"] += 1
+            return default
+        self.entries.move_to_end(key)
+        self.stats[stage]["hits"] += 1
+        return entry[0]
+
+    def put(self, stage: str, args: tuple[Any, ...], value: Any) -> None:
+        key = (stage, args)
+        if key in self.entries:
+            # A recursive stage can fill its own entry while it is being computed
+            self._remove(key)
+        size = entry_bytes(value)
+        self.entries[key] = (value, size)
+        self.bytes += size
+        self.stats[stage]["entries"] += 1
+        self.stats[stage]["bytes"] += size
+        while self.bytes > self.max_bytes and len(self.entries):
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.stats[oldest[0]]["evictions"] += 1
+
+    def discard(self, stage: str, args: tuple[Any, ...]) -> None:
+        if (stage, args) in self.entries:
+            self._remove((stage, args))
+
+    def _remove(self, key: tuple[str, tuple[Any, ...]]) -> None:
+        _, size = self.entries.pop(key)
+        self.bytes -= size
+        self.stats[key[0]]["entries"] -= 1
+        self.stats[key[0]]["bytes"] -= size
+
+    def clear(self, stage: str | None = None) -> None:
+        for key in [k for k in self.entries if stage is None or k[0] == stage]:
+            self._remove(key)
+
+    def info(self, stage: str | None = None) -> dict[str, Any]:
+        """
+        Hits, misses, evictions, entries and bytes of one stage, or of all of them, and the hit rate.
+        """
+        stats = [self.stats[stage]] if stage is not None else list(self.stats.values())
+        res: dict[str, Any] = {k: sum(s[k] for s in stats) for k in ("hits", "misses", "evictions", "entries", "bytes")}
+        lookups = res["hits"] + res["misses"]
+        res["hit_rate"] = res["hits"] / lookups if lookups else 0.0
+        return res
+
+
+STAGE_CACHE = StageCache(STAGE_CACHE_MAX_BYTES)
+# Powers of events are kept under the same budget as the stages that hold the events
+ev.set_power_cache(STAGE_CACHE)
+
+
+def stage_cache_info() -> dict[str, Any]:
+    return STAGE_CACHE.info()
+
+
+# How many stages are being computed, one inside another
+_computing = [0]
+
+
+def stage_cache(first_action: str):
+    """
+    Caches a stage on its normalised arguments rather than on the raw characteristics.
+    A stage resolves first_action and every action after it, so only their modifiers are part of the key.
+    Misses fall through to the persistent store, when one is configured, before computing.
+    """
+    scope = actions.downstream_actions(first_action)
+
+    def decorate(func):
+        signature = inspect.signature(func)
 
+        def load(*args):
+            # Checked on every miss, so configuring the store takes effect without rebuilding the caches
+            persistent = store.active_store()
+            if persistent is None:
+                return func(*args)
+            key = persistent.key(func.__name__, args)
+            value = persistent.get(key)
+            if value is None:
+                value = func(*args)
+                persistent.put(key, func.__name__, value)
+            return value
 
-@lru_cache(maxsize=LRU_CACHEMAX_MAX)
-def feel_no_pain_roll(fnp_char: int, options: AttackOptions, reroll: bool) -> ev.Together:
+        name = func.__name__
+        missing = object()
+
+        @wraps(func)
+        def stage(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            normalise_stage_arguments(bound.arguments, scope)
+            value = STAGE_CACHE.get(name, bound.args, missing)
+            if value is missing:
+                _computing[0] += 1
+                try:
+                    value = load(*bound.args)
+                finally:
+                    _computing[0] -= 1
+                STAGE_CACHE.put(name, bound.args, value)
+                if _computing[0] == 0:
+                    # Powers are reused by the stages within one computation, such as the branches of a reroll,
+                    # and hardly ever after it, so they are dropped rather than left to the budget
+                    ev.drop_all_powers()
+            return value
+
+        stage.cache_info = lambda: STAGE_CACHE.info(name)
+        stage.cache_clear = lambda: STAGE_CACHE.clear(name)
+        return stage
+
+    return decorate
+
+
+# attack_roll with no save_char stops at the save step, where a wound that still has to be saved
+# is an instance of size SAVEABLE and one that bypasses the save is an instance of size UNSAVEABLE
+SAVEABLE = 1
+UNSAVEABLE = 2
+
+
+def _to_save(
+    save_char: int | None,
+    armour_penetration: int,
+    damage_char: int | Dice | None,
+    fnp_char: int | None,
+    options: AttackOptions,
+    engine: ev.EngineOptions,
+) -> ev.Distribution:
+    if save_char is None:
+        return kernels.instance(SAVEABLE, name="to-save")
+    return save_roll(save_char, armour_penetration, damage_char, fnp_char, options, True, engine)
+
+
+def _past_save(
+    save_char: int | None,
+    damage_char: int | Dice | None,
+    fnp_char: int | None,
+    options: AttackOptions,
+    engine: ev.EngineOptions,
+) -> ev.Distribution:
+    if save_char is None:
+        return kernels.instance(UNSAVEABLE, name="past-save")
+    return damage_roll(damage_char, False, fnp_char, options, True, engine)
+
+
+@stage_cache("feel_no_pain_char")
+def feel_no_pain_roll(
+    fnp_char: int, options: AttackOptions, reroll: bool, engine: ev.EngineOptions = ev.DEFAULT_ENGINE
+) -> ev.Distribution:
     # Like the save throw, a successful FNP means a failure to damage. i.e. negation
-    results: list[EventSet] = [
-        ev.Leaf("dmg", suc)
-        for suc in [
-            ev.failure() if fnp.success else ev.success(1)
-            for fnp in actions.feel_no_pain(options.modifiers, fnp_char, options)
-        ]
-    ]
-    return return_res(results, "F")
+    feel_no_pains = actions.feel_no_pain(options.modifiers, fnp_char, options)
+    results: list[EventSet] = [ev.Leaf("dmg", ev.failure() if fnp.success else ev.success(1)) for fnp in feel_no_pains]
+    return return_res(results, "F", engine, [fnp.weight for fnp in feel_no_pains])
 
 
-@lru_cache(maxsize=LRU_CACHEMAX_MAX)
+@stage_cache("damage")
 def damage_roll(
     damage_char: int,
     spill: bool,
     fnp_char: int,
     options: AttackOptions,
     reroll: bool,
-) -> ev.Together:
-    results: list[EventSet] = []
-    for damage in actions.damage(options.modifiers, damage_char, options):
-        possible_damage = []
-        for _ in range(damage.value):
-            possible_damage.append(feel_no_pain_roll(fnp_char, options, True))
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> ev.Distribution:
+    feel_no_pain = feel_no_pain_roll(fnp_char, options, True, engine)
+    damages = actions.damage(options.modifiers, damage_char, options)
+
+    # Each point of damage passes the feel no pain independently, so the points that get through are binomial
+    through = kernels.bernoulli(feel_no_pain)
+    if through is not None:
+        thinned = kernels.thinned_damage(
+            [damage.value for damage in damages], through, [damage.weight for damage in damages], name="D"
+        )
+        return ev.fold_to_horizon(thinned, engine.horizon)
 
-        all = ev.All(tuple(possible_damage))
+    results: list[EventSet] = []
+    for damage in damages:
+        all = ev.Power(feel_no_pain, damage.value)
 
         res = []
-        for key, prob in all.outcomes().items():
+        for key, prob in ev.evaluate(all, engine).items():
             assert key.count <= 1
             if key.count > 0:
                 res.append(ev.Leaf("a", ev.success(key.results[0]), probability=prob))
@@ -60,10 +329,35 @@ def damage_roll(
                 res.append(ev.Leaf("a", ev.failure(), probability=prob))
         results.append(ev.Together(res))
 
-    return return_res(results, "D")
+    # Every damage size is rolled here, so this is the one stage that has to fold to the horizon
+    return ev.fold_to_horizon(return_res(results, "D", engine, [damage.weight for damage in damages]), engine.horizon)
+
 
+@stage_cache("damage")
+def modified_damage_roll(
+    damage_char: int,
+    fnp_char: int,
+    damage_modifiers: tuple[str, ...],
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> ev.Distribution:
+    """
+    damage_roll against a target with the damage modifiers, which apply to the damage before the feel no pain.
+    Both are transforms of the one roll without them, which every target shares.
+    """
+    # Modifiers can shrink damage past the horizon, so the roll they transform is not folded
+    rolled = damage_roll(damage_char, False, 0, options, True, replace(engine, horizon=ev.max_damage))
+    modified = ev.modify_damage(rolled, lambda damage: modify_damage(damage_modifiers, damage))
+    # A single roll is at most one instance, whose size is the damage it does
+    assert modified.keys.sum(axis=1).max(initial=0) <= 1
+    amounts = modified.totals()
+    through = kernels.bernoulli(feel_no_pain_roll(fnp_char, options, True, engine))
+    assert through is not None
+    thinned = kernels.thinned_damage(amounts.tolist(), through, modified.probs.tolist(), name="D")
+    return ev.fold_to_horizon(thinned, engine.horizon)
 
-@lru_cache(maxsize=LRU_CACHEMAX_MAX)
+
+@stage_cache("save")
 def save_roll(
     save_char: int,
     armour_penetration: int,
@@ -71,35 +365,42 @@ def save_roll(
     fnp_char: int,
     options: AttackOptions,
     reroll: bool,
-) -> ev.Together:
-    results: list[EventSet] = []
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> ev.Distribution:
+    # Every save either stops the attack or leads to one of the damage distributions, so the stage is a mixture
+    results: list[ev.Distribution] = []
+    weights: list[float] = []
     for save in actions.save(options.modifiers, save_char, armour_penetration, options):
+        weights.append(save.weight)
         if save.success:
-            results.append(ev.Leaf("s-f", ev.failure()))
+            results.append(kernels.nothing())
         elif save.reroll and reroll:
-            results.append(save_roll(save_char, armour_penetration, damage_char, fnp_char, options, False))
+            results.append(save_roll(save_char, armour_penetration, damage_char, fnp_char, options, False, engine))
         else:
-            results.append(damage_roll(damage_char, False, fnp_char, options, True))
-    return return_res(results, "S")
+            results.append(damage_roll(damage_char, False, fnp_char, options, True, engine))
+    return kernels.mixture(results, weights, name="S")
 
 
-@lru_cache(maxsize=LRU_CACHEMAX_MAX)
+@stage_cache("wound")
 def wound_roll(
     strength_char: int,
     target_toughness: int,
-    save_char: int,
+    save_char: int | None,
     armour_penetration: int,
     damage_char: int,
     fnp_char: int,
     options: AttackOptions,
     reroll: bool,
-) -> ev.Together:
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> ev.Distribution:
     results: list[EventSet] = []
+    weights: list[float] = []
     for wound in actions.wound(options.modifiers, strength_char, target_toughness, options):
+        weights.append(wound.weight)
         if wound.bypass_next:
-            results.append(damage_roll(damage_char, False, fnp_char, options, True))
+            results.append(_past_save(save_char, damage_char, fnp_char, options, engine))
         elif wound.success:
-            results.append(save_roll(save_char, armour_penetration, damage_char, fnp_char, options, True))
+            results.append(_to_save(save_char, armour_penetration, damage_char, fnp_char, options, engine))
         elif wound.reroll and reroll:
             results.append(
                 wound_roll(
@@ -111,42 +412,38 @@ def wound_roll(
                     fnp_char,
                     options,
                     False,
+                    engine,
                 )
             )
         else:
             results.append(ev.Leaf("w-f", ev.failure()))
-    return return_res(results, "W")
+    return return_res(results, "W", engine, weights)
 
 
-@lru_cache(maxsize=LRU_CACHEMAX_MAX)
+@stage_cache("hit")
 def hit_roll(
     weapon_skill: int,
     strength_char: int,
     target_toughness: int,
-    save_char: int,
+    save_char: int | None,
     armour_penetration: int,
     damage_char: int,
     fnp_char: int,
     options: AttackOptions,
     reroll: bool,
-) -> ev.Together:
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> ev.Distribution:
     results: list[EventSet] = []
+    weights: list[float] = []
+    bypass_counts: dict[int, Probability] = defaultdict(float)
+    success_counts: dict[int, Probability] = defaultdict(float)
     for hit in actions.hit(options.modifiers, weapon_skill, options):
         if hit.bypass_next:
-            possible_hits: list[EventSet] = []
-            save_results = save_roll(save_char, armour_penetration, damage_char, fnp_char, options, True)
-            for _ in range(hit.value):
-                possible_hits.append(save_results)
-            results.append(ev.All(tuple(possible_hits), name="h-b"))
+            bypass_counts[hit.value] += hit.weight
         elif hit.success:
-            possible_hits: list[EventSet] = []
-            wound_results = wound_roll(
-                strength_char, target_toughness, save_char, armour_penetration, damage_char, fnp_char, options, True
-            )
-            for _ in range(hit.value):
-                possible_hits.append(wound_results)
-            results.append(ev.All(tuple(possible_hits), name="h-s"))
+            success_counts[hit.value] += hit.weight
         elif hit.reroll and reroll:
+            weights.append(hit.weight)
             results.append(
                 hit_roll(
                     weapon_skill,
@@ -158,57 +455,62 @@ def hit_roll(
                     fnp_char,
                     options,
                     False,
+                    engine,
                 )
             )
         else:
+            weights.append(hit.weight)
             results.append(ev.Leaf("h-f", ev.failure()))
-    return return_res(results, "H")
+
+    if len(bypass_counts):
+        save_results = _to_save(save_char, armour_penetration, damage_char, fnp_char, options, engine)
+        # A compound is already as likely as the sum of its counts
+        weights.append(1)
+        results.append(ev.Compound(save_results, dict(bypass_counts), name="h-b"))
+    if len(success_counts):
+        wound_results = wound_roll(
+            strength_char,
+            target_toughness,
+            save_char,
+            armour_penetration,
+            damage_char,
+            fnp_char,
+            options,
+            True,
+            engine,
+        )
+        weights.append(1)
+        results.append(ev.Compound(wound_results, dict(success_counts), name="h-s"))
+    return return_res(results, "H", engine, weights)
 
 
-@lru_cache(maxsize=LRU_CACHEMAX_MAX)
+@stage_cache("attack")
 def attack_roll(
     attack_char: int | Dice,
     weapon_skill: int,
     strength_char: int,
     target_toughness: int,
-    save_char: int,
+    save_char: int | None,
     armour_penetration: int,
     damage_char: int | Dice,
     fnp_char: int,
     options: AttackOptions,
     reroll: bool,
-) -> tuple[ev.Together, tuple[int, int]]:
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> tuple[ev.Distribution, tuple[int, int]]:
     results: list[EventSet] = []
     all_possibilities = tuple()
+    # Attacks of the same kind only differ in how many there are, so each kind is expanded as one compound
+    bypass_counts: dict[int, Probability] = defaultdict(float)
+    success_counts: dict[int, Probability] = defaultdict(float)
+    weights: list[float] = []
     for attack in actions.attack(options.modifiers, attack_char, options):
         if attack.bypass_next:
-            possible_attacks: list[EventSet] = []
-            wound_results = wound_roll(
-                strength_char, target_toughness, save_char, armour_penetration, damage_char, fnp_char, options, True
-            )
-            for _ in range(attack.value):
-                possible_attacks.append(wound_results)
-            all_possibilities = (attack.value, len(wound_results.events))
-            results.append(ev.All(possible_attacks, name="byp"))
+            bypass_counts[attack.value] += attack.weight
         elif attack.success:
-            possible_attacks: list[EventSet] = []
-            hit_results = hit_roll(
-                weapon_skill,
-                strength_char,
-                target_toughness,
-                save_char,
-                armour_penetration,
-                damage_char,
-                fnp_char,
-                options,
-                True,
-            )
-
-            for _ in range(attack.value):
-                possible_attacks.append(hit_results)
-            all_possibilities = (attack.value, len(hit_results.events))
-            results.append(ev.All(possible_attacks, name="suc"))
+            success_counts[attack.value] += attack.weight
         elif attack.reroll and reroll:
+            weights.append(attack.weight)
             attack_result, all_possibilities = attack_roll(
                 attack_char,
                 weapon_skill,
@@ -220,9 +522,256 @@ def attack_roll(
                 fnp_char,
                 options,
                 False,
+                engine,
             )
             results.append(attack_result)
         else:
+            weights.append(attack.weight)
             results.append(ev.Leaf("attack", ev.failure()))
             all_possibilities = (1, 1)
-    return return_res(results, "A"), all_possibilities
+
+    if len(bypass_counts):
+        wound_results = wound_roll(
+            strength_char,
+            target_toughness,
+            save_char,
+            armour_penetration,
+            damage_char,
+            fnp_char,
+            options,
+            True,
+            engine,
+        )
+        all_possibilities = (max(bypass_counts), len(wound_results))
+        weights.append(1)
+        results.append(ev.Compound(wound_results, dict(bypass_counts), name="byp"))
+    if len(success_counts):
+        hit_results = hit_roll(
+            weapon_skill,
+            strength_char,
+            target_toughness,
+            save_char,
+            armour_penetration,
+            damage_char,
+            fnp_char,
+            options,
+            True,
+            engine,
+        )
+        all_possibilities = (max(success_counts), len(hit_results))
+        weights.append(1)
+        results.append(ev.Compound(hit_results, dict(success_counts), name="suc"))
+    return return_res(results, "A", engine, weights), all_possibilities
+
+
+@stage_cache("save")
+def save_failure(
+    save_char: int, armour_penetration: int, invulnerable_save: int, options: AttackOptions, reroll: bool
+) -> float:
+    """
+    The chance a wound that reaches the save goes on to roll damage.
+    """
+    saves = actions.save(options.modifiers, save_char, armour_penetration, options)
+    failed = 0.0
+    for save in saves:
+        if save.success:
+            continue
+        elif save.reroll and reroll:
+            failed += save.weight * save_failure(save_char, armour_penetration, invulnerable_save, options, False)
+        else:
+            failed += save.weight
+    return failed / sum(save.weight for save in saves)
+
+
+def split_saved_rolls(reached: ev.Distribution, failed: float) -> dict[tuple[int, int], Probability]:
+    """
+    How many damage rolls the wounds in reached, the result of attack_roll stopped at the save step, make once saved,
+    as the rolls of wounds that failed their save and of wounds that bypassed it, and the chance of each.
+    Every wound that has to be saved fails independently with chance failed.
+    """
+    keys = np.zeros((len(reached), UNSAVEABLE), dtype=np.int64)
+    width = min(reached.keys.shape[1], UNSAVEABLE)
+    keys[:, :width] = reached.keys[:, :width]
+    rolls: dict[tuple[int, int], Probability] = defaultdict(float)
+    for (saveable, unsaveable), prob in zip(keys, reached.probs, strict=True):
+        for ii, p in enumerate(kernels.binomial(int(saveable), failed)):
+            if p > 0:
+                rolls[ii, int(unsaveable)] += float(prob * p)
+    return dict(rolls)
+
+
+def saved_rolls(reached: ev.Distribution, failed: float) -> dict[int, Probability]:
+    """
+    split_saved_rolls without telling the rolls that bypassed the save apart.
+    """
+    rolls: dict[int, Probability] = defaultdict(float)
+    for (failed_rolls, bypassed_rolls), prob in split_saved_rolls(reached, failed).items():
+        rolls[failed_rolls + bypassed_rolls] += prob
+    if reached.support is not None:
+        # Pruned wounds could have made more rolls, a count of no weight keeps estimates of the compound covering them
+        rolls[reached.estimate().instances] += 0.0
+    return dict(rolls)
+
+
+@stage_cache("attack")
+def damage_rolls(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    save_char: int,
+    armour_penetration: int,
+    invulnerable_save: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> dict[int, Probability]:
+    """
+    saved_rolls of the weapon against the target. A sweep over saves expands the attacks, hits and wounds only once,
+    and nothing from the damage on is rolled, so sweeps over damage and feel no pain share them all.
+    """
+    reached = reached_save(attack_char, weapon_skill, strength_char, target_toughness, options, engine)
+    return saved_rolls(reached, save_failure(save_char, armour_penetration, invulnerable_save, options, True))
+
+
+@stage_cache("attack")
+def split_damage_rolls(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    save_char: int,
+    armour_penetration: int,
+    invulnerable_save: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> dict[tuple[int, int], Probability]:
+    """
+    split_saved_rolls of the weapon against the target, damage_rolls with the rolls that bypass the save apart.
+    """
+    reached = reached_save(attack_char, weapon_skill, strength_char, target_toughness, options, engine)
+    return split_saved_rolls(reached, save_failure(save_char, armour_penetration, invulnerable_save, options, True))
+
+
+def reached_save(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+) -> ev.Distribution:
+    reached, _ = attack_roll(
+        attack_char, weapon_skill, strength_char, target_toughness, None, 0, None, None, options, True, engine
+    )
+    return reached
+
+
+def saved_attack_tree(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    save_char: int,
+    armour_penetration: int,
+    invulnerable_save: int,
+    damage_char: int | Dice,
+    fnp_char: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+    damage_modifiers: tuple[str, ...] = (),
+) -> ev.Compound:
+    """
+    The unexpanded compound of damage rolls that attack_roll expands, which also takes an invulnerable save.
+    A feel no pain and the target's damage modifiers only change each damage roll, so they only change the
+    single damage roll.
+    """
+    rolls = damage_rolls(
+        attack_char,
+        weapon_skill,
+        strength_char,
+        target_toughness,
+        save_char,
+        armour_penetration,
+        invulnerable_save,
+        options,
+        engine,
+    )
+    if len(damage_modifiers):
+        roll = modified_damage_roll(damage_char, fnp_char, damage_modifiers, options, engine)
+    else:
+        roll = damage_roll(damage_char, False, fnp_char, options, True, engine)
+    return ev.Compound(roll, rolls, name="saved")
+
+
+@stage_cache("attack")
+def saved_attack_roll(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    save_char: int,
+    armour_penetration: int,
+    invulnerable_save: int,
+    damage_char: int | Dice,
+    fnp_char: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+    damage_modifiers: tuple[str, ...] = (),
+) -> ev.Distribution:
+    tree = saved_attack_tree(
+        attack_char,
+        weapon_skill,
+        strength_char,
+        target_toughness,
+        save_char,
+        armour_penetration,
+        invulnerable_save,
+        damage_char,
+        fnp_char,
+        options,
+        engine,
+        damage_modifiers,
+    )
+    # Not a Together, which would make up any probability pruned from the wounds
+    return ev.collapse_tree(tree, name="A", engine=engine)
+
+
+def unit_attack_roll(
+    attack_char: int | Dice,
+    weapon_skill: int,
+    strength_char: int,
+    target_toughness: int,
+    save_char: int,
+    armour_penetration: int,
+    invulnerable_save: int,
+    damage_char: int | Dice,
+    fnp_char: int,
+    models: int,
+    wounds: int,
+    options: AttackOptions,
+    engine: ev.EngineOptions = ev.DEFAULT_ENGINE,
+    damage_modifiers: tuple[str, ...] = (),
+    spill: bool = True,
+) -> np.ndarray:
+    """
+    The chance of 0..models models of a unit being removed, each model having the wounds.
+    Damage from wounds that bypass the save is allocated last, and spills over when spill is set.
+    """
+    rolls = split_damage_rolls(
+        attack_char,
+        weapon_skill,
+        strength_char,
+        target_toughness,
+        save_char,
+        armour_penetration,
+        invulnerable_save,
+        options,
+        engine,
+    )
+    # Damage that spills can remove more models than the horizon has wounds, so the roll is not folded
+    full = replace(engine, horizon=ev.max_damage)
+    if len(damage_modifiers):
+        roll = modified_damage_roll(damage_char, fnp_char, damage_modifiers, options, full)
+    else:
+        roll = damage_roll(damage_char, False, fnp_char, options, True, full)
+    return unit.models_killed(roll, rolls, models, wounds, spill)
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+# Results depend on the code of these modules, so a change to any of them starts a fresh cache
+ENGINE_SOURCES = ["events.py", "dense.py", "kernels.py", "roll.py", "model.py", "outcomes.py", "actions"]
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+PICKLE_PROTOCOL = 5
+
+# Once over budget, entries are evicted until the store is down to this fraction of it,
+# so a store at its budget does not evict on every put
+EVICT_TO = 0.9
+# Hits whose last used time is only written out once this many are pending, so reads stay reads
+USED_BATCH = 64
+
+
+@lru_cache(maxsize=1)
+def engine_version() -> str:
+    """
+    A hash of the engine's source, part of every key so stale results are never read back.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for source in ENGINE_SOURCES:
+        path = os.path.join(root, source)
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".py"))
+        else:
+            files = [path]
+        for fle in files:
+            digest.update(os.path.relpath(fle, root).encode())
+            with open(fle, "rb") as data:
+                digest.update(data.read())
+    return digest.hexdigest()
+
+
+@dataclass
+class StoreStats:
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+
+class StageStore:
+    """
+    Stage results kept on disk in SQLite, shared between runs and between processes.
+    WAL mode lets readers carry on while one process writes, and the least recently
+    used entries are evicted once the stored values exceed max_bytes.
+    Triggers keep the total size in a single row, so a put only has to read that to know whether to evict.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "stages.sqlite")
+        self.max_bytes = max_bytes
+        self.stats = StoreStats()
+        self._local = threading.local()
+        self._used: dict[bytes, float] = {}
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key BLOB PRIMARY KEY, stage TEXT NOT NULL, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            # Stores written before the total was kept start from what they hold
+            conn.execute("INSERT OR IGNORE INTO total (id, size) SELECT 0, TOTAL(size) FROM entries")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries "
+                "BEGIN UPDATE total SET size = size + NEW.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries "
+                "BEGIN UPDATE total SET size = size - OLD.size; END"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # So a replacing insert runs the delete trigger and the total stays right
+            conn.execute("PRAGMA recursive_triggers=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def key(stage: str, arguments: tuple[Any, ...]) -> bytes:
+        # The stage arguments are plain values and frozen dataclasses, whose repr is canonical,
+        # where a pickle would also encode which equal arguments happened to be the same object
+        return hashlib.sha256(repr((engine_version(), stage, arguments)).encode()).digest()
+
+    def get(self, key: bytes) -> Any | None:
+        with self._connection() as conn:
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+        self.stats.hits += 1
+        self._used[key] = time.time()
+        if len(self._used) >= USED_BATCH:
+            with self._connection() as conn:
+                self._write_used(conn)
+        return pickle.loads(row[0])
+
+    def _write_used(self, conn: sqlite3.Connection) -> None:
+        conn.executemany("UPDATE entries SET used = ? WHERE key = ?", [(t, k) for k, t in self._used.items()])
+        self._used.clear()
+
+    def put(self, key: bytes, stage: str, value: Any) -> None:
+        data = pickle.dumps(value, protocol=PICKLE_PROTOCOL)
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, stage, value, size, used) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, data, len(data), time.time()),
+            )
+            self.stats.writes += 1
+            total = conn.execute("SELECT size FROM total").fetchone()[0]
+            if total > self.max_bytes:
+                # The pending hits count as uses, or entries just read could be the ones evicted
+                self._write_used(conn)
+                self._evict(conn, total - int(self.max_bytes * EVICT_TO))
+
+    def _evict(self, conn: sqlite3.Connection, excess: int) -> None:
+        """
+        Deletes the least recently used entries until at least excess bytes are freed, walking the used index.
+        """
+        keys = []
+        freed = 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY used"):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+        self.stats.evictions += len(keys)
+
+    def size(self) -> int:
+        with self._connection() as conn:
+            return int(conn.execute("SELECT size FROM total").fetchone()[0])
+
+    def __len__(self) -> int:
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+_store: StageStore | None = None
+
+
+def configure(directory: str | None, max_bytes: int = DEFAULT_MAX_BYTES) -> StageStore | None:
+    """
+    Persists stage results under directory from now on, or stops persisting them when directory is None.
+    """
+    global _store
+    _store = None if directory is None else StageStore(directory, max_bytes)
+    return _store
+
+
+def active_store() -> StageStore | None:
+    return _store
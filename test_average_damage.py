@@ -6,7 +6,12 @@ import roll as rl
 from actions import AttackOptions
 import actions
 from outcomes import Dice
-from events import average_damage
+import events as ev
+from events import average_damage, cap_damage, capped_damage_summary, cumulative_damage_probabilities
+
+from model import SimpleModel
+from moments import expected_damage
+from weapon import SimpleWeapon
 
 from testutils import nearly, ExpectedOutcomes
 
@@ -113,8 +118,78 @@ def test_A1Dd3():
     nearly(avg_dam, (1 + 2 + 3) * (pass_hit * pass_wound) * third)
 
 
+def test_capped_damage_summary():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+    damage, _ = rl.attack_roll(4, 3, 4, 4, 4, 0, Dice(1, 6), 0, options, True)
+
+    caps = [1, 2, 3, 6, 14]
+    averages, cumulative = capped_damage_summary(damage, caps, 9)
+    for kk, cap in enumerate(caps):
+        capped = cap_damage(damage, cap)
+        nearly(averages[kk], average_damage(capped))
+        for ii, p in enumerate(cumulative_damage_probabilities(capped, 9)):
+            nearly(cumulative[kk, ii], p)
+
+    # The dict form gives the same
+    dict_averages, _ = capped_damage_summary(damage.outcomes(), caps, 9)
+    for a, b in zip(averages, dict_averages, strict=True):
+        nearly(a, b)
+
+
+def test_add_capped_totals():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+    first = rl.saved_attack_tree(2, 3, 4, 4, 4, 0, 7, Dice(1, 3), 0, options)
+    second = rl.saved_attack_tree(Dice(1, 3), 4, 8, 4, 4, 2, 7, 3, 6, options)
+    caps = [1, 2, 3, 6]
+    # Two of the first weapon and one of the second fire together
+    averages, exact = ev.add_capped_totals(
+        [(*ev.capped_totals(first, caps, 9), 2), (*ev.capped_totals(second, caps, 9), 1)]
+    )
+    expected = ev.All([ev.collapse_tree(first), ev.collapse_tree(first), ev.collapse_tree(second)])
+    expected_averages, expected_at_least = capped_damage_summary(expected, caps, 9)
+    at_least = ev.at_least_damage(exact)
+    for kk in range(len(caps)):
+        nearly(averages[kk], expected_averages[kk])
+        for ii in range(9):
+            nearly(at_least[kk, ii], expected_at_least[kk, ii])
+
+
+def test_expected_damage():
+    for modifiers, attacks, damage_char, fnp_char in [
+        ((), 4, 1, 0),
+        ((actions.sustained_hits(1), actions.lethal_hits), Dice(2, 6), Dice(1, 3), 5),
+        ((actions.devastating_wounds, actions.twin_linked, actions.reroll_hit_1), Dice(1, 6), 2, 6),
+        ((actions.torrent, actions.melta(2), actions.rapid_fire(Dice(1, 3))), Dice(1, 6), Dice(1, 6), 0),
+    ]:
+        weapon = SimpleWeapon("w", 24, attacks, 3, 5, 1, damage_char, modifiers)
+        target = SimpleModel("t", T=4, S=4, W=1, FNP=fnp_char)
+        options = AttackOptions(half_range=True, cover=False, anti_active=False, modifiers=modifiers)
+        damage, _ = rl.attack_roll(attacks, 3, 5, 4, 4, 1, damage_char, fnp_char, options, True)
+
+        moments = expected_damage(weapon, target, options)
+        nearly(moments.mean, average_damage(damage))
+        totals = damage.totals()
+        nearly(moments.variance, damage.probs @ totals**2 - average_damage(damage) ** 2)
+
+    # Halving a d6 rolls like a d3
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=())
+    halved = expected_damage(
+        SimpleWeapon("w", 24, 4, 3, 5, 1, Dice(1, 6), ()),
+        SimpleModel("t", T=4, S=4, W=1, FNP=5, damage_modifiers=("Halve Damage",)),
+        options,
+    )
+    expected = expected_damage(
+        SimpleWeapon("w", 24, 4, 3, 5, 1, Dice(1, 3), ()), SimpleModel("t", T=4, S=4, W=1, FNP=5), options
+    )
+    nearly(halved.mean, expected.mean)
+    nearly(halved.variance, expected.variance)
+
+
 if __name__ == "__main__":
     test_A1D1()
     test_A1D2()
     test_A2D1()
     test_A1Dd3()
+    test_capped_damage_summary()
+    test_add_capped_totals()
+    test_expected_damage()
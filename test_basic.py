@@ -203,6 +203,16 @@ def test_Ad3D1():
     eo.test(damage.outcomes())
 
 
+def test_dice():
+    assert Dice.from_str("3D6").distribution()[:3] == ((3, 1), (4, 3), (5, 6))
+    assert sum(w for _, w in Dice.from_str("3d6").distribution()) == 6**3
+    assert Dice.from_str("2D6+3").distribution()[0] == (5, 1)
+    assert Dice.from_str("D6+D3") == Dice.from_str("d3+d6") == Dice(1, 3, 0, ((1, 6),))
+    assert Dice.from_str("D6+D3").distribution() == ((2, 1), (3, 2), (4, 3), (5, 3), (6, 3), (7, 3), (8, 2), (9, 1))
+    assert str(Dice.from_str("2d6+d3+1")) == "2d6+d3+1"
+    assert Dice(1, 6)() is not Dice(1, 6)()
+
+
 if __name__ == "__main__":
     test_A1D1()
     test_A1D2()
@@ -210,3 +220,4 @@ if __name__ == "__main__":
     test_A1Dd3()
     test_Ad2D1()
     test_Ad3D1()
+    test_dice()
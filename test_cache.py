@@ -0,0 +1,138 @@
+# ruff: noqa: N802, N806
+
+import subprocess
+import sys
+
+import numpy as np
+
+import events as ev
+import roll as rl
+from actions import AttackOptions
+import actions
+from outcomes import Dice
+
+
+def test_wound_threshold():
+    for strength, toughness, threshold in [(9, 4, 2), (8, 4, 3), (5, 4, 3), (4, 4, 4), (3, 4, 5), (2, 4, 6), (4, 8, 6)]:
+        assert rl.wound_threshold(strength, toughness) == threshold
+        assert rl.wound_threshold(*rl.effective_wound(strength, toughness)) == threshold
+
+
+def test_shared_targets():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.lethal_hits,))
+
+    def roll(toughness, save_char, armour_penetration, fnp_char=0):
+        damage, _ = rl.attack_roll(3, 3, 4, toughness, save_char, armour_penetration, 2, fnp_char, options, True)
+        return damage
+
+    assert roll(5, 4, 0) is roll(6, 4, 0)
+    assert roll(5, 3, -1) is roll(5, 4, 0)
+    assert roll(5, 7, 0) is roll(5, 5, -3)
+    assert roll(5, 4, -1) is not roll(5, 4, 0)
+    assert roll(5, 4, 0, 7) is roll(5, 4, 0, 0)
+    assert roll(4, 4, 0) is not roll(5, 4, 0)
+
+    first, _ = rl.attack_roll(Dice(1, 6), 3, 4, 4, 4, 0, Dice(1, 3), 0, options, True)
+    second, _ = rl.attack_roll(Dice(1, 6), 3, 4, 4, 4, 0, Dice(1, 3), 0, options, True)
+    assert first is second
+
+
+def test_scoped_modifiers():
+    def options(*modifiers, half_range=False):
+        return AttackOptions(half_range=half_range, cover=True, anti_active=True, modifiers=modifiers)
+
+    def wound(opts):
+        return rl.wound_roll(4, 4, 4, 0, 1, 0, opts, True)
+
+    # Hit stage keywords and flags no wound, save or damage modifier reads leave the wound stage alone
+    assert wound(options()) is wound(options(actions.lethal_hits, actions.sustained_hits(1), half_range=True))
+    assert wound(options(actions.twin_linked)) is not wound(options())
+    assert rl.damage_roll(2, False, 0, options(actions.twin_linked), True) is rl.damage_roll(
+        2, False, 0, options(), True
+    )
+    assert rl.damage_roll(1, False, 0, options(actions.melta(2)), True) is not rl.damage_roll(
+        1, False, 0, options(actions.melta(2), half_range=True), True
+    )
+
+
+def test_stage_cache_budget():
+    def distribution(outcomes):
+        return ev.Distribution(np.ones((outcomes, 1), dtype=np.int64), np.full(outcomes, 1 / outcomes))
+
+    small = rl.entry_bytes(distribution(1))
+    large = rl.entry_bytes(distribution(10_000))
+    cache = rl.StageCache(max_bytes=large + 2 * small)
+
+    for ii in range(3):
+        cache.put("small", (ii,), distribution(1))
+    assert cache.get("small", (0,)) is not None
+    # The large entry pushes out the least recently used small one, not all of them
+    cache.put("large", (0,), distribution(10_000))
+    assert cache.bytes <= cache.max_bytes
+    assert cache.get("small", (1,)) is None
+    assert cache.get("small", (0,)) is not None
+    assert cache.get("large", (0,)) is not None
+
+    info = cache.info("small")
+    assert info["evictions"] == 1
+    assert info["entries"] == 2
+    assert info["hits"] == 2 and info["misses"] == 1
+    assert cache.info()["bytes"] == cache.bytes
+    cache.clear("large")
+    assert cache.bytes == 2 * small
+
+
+def test_powers_in_stage_cache():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=tuple())
+    wounds = rl.wound_roll(5, 4, 4, 1, Dice(1, 3), 7, options, True)
+    # Powers are charged to the stage cache, and go with the event
+    ev.Power(wounds, 4).outcomes()
+    assert rl.STAGE_CACHE.info("power")["entries"] > 0
+    assert rl.STAGE_CACHE.info("power")["bytes"] > 0
+    ev.drop_powers(wounds)
+    assert rl.STAGE_CACHE.info("power")["entries"] == 0
+
+    # A stage computed from scratch leaves none of the powers it used behind
+    rl.hit_roll.cache_clear()
+    rl.hit_roll(3, 5, 4, 4, 1, Dice(1, 3), 7, options, True)
+    assert ev.power_cache_info()["misses"] > 0
+    assert rl.STAGE_CACHE.info("power")["entries"] == 0
+
+
+# Powers of an instance of 1 to 3 damage, using events alone, which leaves no cache to keep them in
+POWERS_WITHOUT_ROLL = """
+import sys
+import events as ev
+results = [tuple(int(ii == n) for ii in range(ev.max_damage)) for n in range(3)]
+leaves = [ev.Leaf("", ev.EventResult(result, n + 1), 1 / 3) for n, result in enumerate(results)]
+outcomes = ev.Power(ev.Together(leaves), 80).outcomes()
+assert "roll" not in sys.modules
+print(len(outcomes), ev.power_cache_info()["misses"])
+"""
+
+
+def test_powers_without_cache():
+    # Every power the recursion needs is built once, with or without a cache to keep it in
+    result = subprocess.run([sys.executable, "-c", POWERS_WITHOUT_ROLL], capture_output=True, text=True, check=True)
+    outcomes, misses = map(int, result.stdout.split())
+    assert outcomes == 3321
+    assert misses <= 80
+
+    # Nor when the cache is too small to hold any of them
+    wounds = rl.wound_roll(5, 4, 4, 1, 1, 7, AttackOptions(False, False, False, tuple()), True)
+    previous = ev.power_cache_info()["misses"]
+    max_bytes, rl.STAGE_CACHE.max_bytes = rl.STAGE_CACHE.max_bytes, 1
+    try:
+        ev.Power(wounds, 60).outcomes()
+    finally:
+        rl.STAGE_CACHE.max_bytes = max_bytes
+    assert ev.power_cache_info()["misses"] - previous < 10
+
+
+if __name__ == "__main__":
+    test_wound_threshold()
+    test_shared_targets()
+    test_scoped_modifiers()
+    test_stage_cache_budget()
+    test_powers_in_stage_cache()
+    test_powers_without_cache()
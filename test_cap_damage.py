@@ -6,7 +6,8 @@ import roll as rl
 from actions import AttackOptions
 import actions
 from outcomes import Dice
-from events import cap_damage
+import events as ev
+from events import cap_damage, average_damage, cumulative_damage_probabilities
 
 from testutils import nearly, ExpectedOutcomes
 
@@ -111,7 +112,29 @@ def test_A1Dd3():
     eo.test(cap_damage(damage.outcomes(), damage_cap))
 
 
+def test_horizon():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+
+    def roll(engine):
+        damage, _ = rl.attack_roll(3, 3, 4, 4, 4, 0, Dice(2, 6), 0, options, True, engine)
+        return damage
+
+    for backend in [ev.DICT_BACKEND, ev.NUMPY_BACKEND]:
+        full = roll(ev.EngineOptions(backend))
+        folded = roll(ev.EngineOptions(backend, horizon=4))
+        assert len(folded) < len(full)
+        for cap in range(1, 5):
+            nearly(average_damage(cap_damage(folded, cap)), average_damage(cap_damage(full, cap)))
+            for a, b in zip(
+                cumulative_damage_probabilities(cap_damage(folded, cap), 9),
+                cumulative_damage_probabilities(cap_damage(full, cap), 9),
+                strict=True,
+            ):
+                nearly(a, b)
+
+
 if __name__ == "__main__":
     test_A1DN()
     test_Ad2D1()
     test_A1Dd3()
+    test_horizon()
@@ -0,0 +1,269 @@
+# ruff: noqa: N802, N806
+
+import numpy as np
+
+import roll as rl
+import events as ev
+from actions import AttackOptions
+import actions
+from outcomes import Dice
+
+
+def compare_backends(modifiers, attack_char, damage_char, save_char=4, fnp_char=7):
+    options = AttackOptions(half_range=True, cover=False, anti_active=False, modifiers=modifiers)
+    results = []
+    for backend in [ev.DICT_BACKEND, ev.NUMPY_BACKEND]:
+        damage, _ = rl.attack_roll(
+            attack_char=attack_char,
+            weapon_skill=3,
+            strength_char=5,
+            target_toughness=4,
+            save_char=save_char,
+            armour_penetration=1,
+            damage_char=damage_char,
+            fnp_char=fnp_char,
+            options=options,
+            reroll=True,
+            engine=ev.EngineOptions(backend),
+        )
+        results.append(damage.outcomes())
+
+    dict_outcomes, numpy_outcomes = results
+    assert dict_outcomes.keys() == numpy_outcomes.keys()
+    for key, prob in dict_outcomes.items():
+        assert abs(numpy_outcomes[key] - prob) < 1e-9
+
+
+def test_A4D1():
+    compare_backends(tuple(), 4, 1)
+
+
+def test_Ad6Dd3SH1():
+    compare_backends((actions.sustained_hits(1),), Dice(1, 6), Dice(1, 3))
+
+
+def test_A3D2LHDW():
+    compare_backends((actions.lethal_hits, actions.devastating_wounds, actions.twin_linked), 3, 2, fnp_char=5)
+
+
+def test_A2Dd6RF():
+    compare_backends((actions.rapid_fire(Dice(1, 3)), actions.melta(2)), 2, Dice(1, 6), save_char=7)
+
+
+def test_power():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+    hits = rl.hit_roll(3, 5, 4, 4, 1, 2, 7, options, True)
+
+    sequential = {}
+    for amount in range(1, 8):
+        joined = ev.Leaf("start", ev.failure())
+        for _ in range(amount):
+            joined = ev.collapse_tree(ev.All((joined, hits)))
+        sequential[amount] = joined.outcomes()
+
+    for backend in [ev.DICT_BACKEND, ev.NUMPY_BACKEND]:
+        for amount in range(7, 0, -1):
+            outcomes = ev.evaluate(ev.Power(hits, amount), ev.EngineOptions(backend))
+            assert outcomes.keys() == sequential[amount].keys()
+            for key, prob in sequential[amount].items():
+                assert abs(outcomes[key] - prob) < 1e-9
+
+    before = ev.power_cache_info()
+    ev.Power(hits, 6).outcomes()
+    assert ev.power_cache_info()["hits"] == before["hits"] + 1
+    assert ev.power_cache_info()["misses"] == before["misses"]
+
+
+def test_compound():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=tuple())
+    hits = rl.hit_roll(3, 5, 4, 4, 1, Dice(1, 3), 7, options, True)
+    counts = {0: 1, 2: 2, 5: 1}
+
+    expected = ev.Together(
+        [ev.Leaf("none", ev.failure()), ev.Power(hits, 2), ev.Power(hits, 2), ev.Power(hits, 5)]
+    ).outcomes()
+    for backend in [ev.DICT_BACKEND, ev.NUMPY_BACKEND]:
+        compound = ev.Compound(hits, counts)
+        assert compound.probability == 4
+        outcomes = ev.evaluate(ev.Together([compound]), ev.EngineOptions(backend))
+        assert outcomes.keys() == expected.keys()
+        for key, prob in expected.items():
+            assert abs(outcomes[key] - prob) < 1e-9
+
+
+def test_distribution():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.lethal_hits,))
+    damage, _ = rl.attack_roll(3, 3, 5, 4, 4, 1, Dice(1, 3), 7, options, True)
+    outcomes = damage.outcomes()
+
+    assert isinstance(damage, ev.Distribution)
+    assert len(damage) == len(outcomes)
+    assert damage.keys.shape[1] == 3
+    assert damage.keys.dtype == np.uint8
+
+    assert abs(ev.average_damage(damage) - ev.average_damage(outcomes)) < 1e-9
+    for expected, prob in zip(
+        ev.cumulative_damage_probabilities(outcomes, 9), ev.cumulative_damage_probabilities(damage, 9), strict=True
+    ):
+        assert abs(expected - prob) < 1e-9
+    for cap in range(1, 4):
+        capped = ev.cap_damage(damage, cap)
+        assert abs(ev.average_damage(capped) - ev.average_damage(ev.cap_damage(outcomes, cap))) < 1e-9
+
+    both = ev.All((damage, damage)).outcomes()
+    assert abs(sum(both.values()) - 1) < 1e-9
+
+
+def test_outcome_cache():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=tuple())
+    hits = rl.hit_roll(3, 5, 4, 4, 1, 2, 7, options, True)
+
+    power = ev.Power(hits, 3)
+    before = ev.outcome_cache_info()
+    first = power.outcomes()
+    assert power.outcomes() is first
+    assert ev.outcome_cache_info()["hits"] == before["hits"] + 1
+
+    uncached = ev.Power(hits, 3, cache=False)
+    assert uncached.outcomes() is not uncached.outcomes()
+    assert uncached.outcomes() == first
+
+
+def test_budget():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=tuple())
+    wounds = rl.wound_roll(5, 4, 4, 1, Dice(1, 3), 7, options, True)
+
+    for tree in [
+        ev.Power(wounds, 5),
+        ev.Compound(wounds, {1: 1.0, 4: 2.0}),
+        ev.Together([wounds, ev.Power(wounds, 2)]),
+    ]:
+        assert tree.estimate().outcomes >= len(tree.outcomes())
+
+    previous = ev.set_budget(ev.Budget(max_outcomes=100))
+    try:
+        ev.Power(wounds, 12).outcomes()
+        raise AssertionError("Expected the budget to be exceeded")
+    except rl.ProbabilityTreeTooLargeError as e:
+        assert e.estimate > 100
+    finally:
+        ev.set_budget(previous)
+
+    # Many instances of few sizes are bounded by the multisets of them, not by every slot's range
+    hits = ev.Compound(wounds, {ii: 1.0 for ii in range(2, 13)})
+    assert hits.estimate().outcomes < 10 * len(hits.outcomes())
+
+
+def test_pruning():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.lethal_hits,))
+    results = []
+    for epsilon in [0.0, 1e-4]:
+        damage, _ = rl.attack_roll(
+            attack_char=Dice(2, 6),
+            weapon_skill=3,
+            strength_char=5,
+            target_toughness=4,
+            save_char=4,
+            armour_penetration=1,
+            damage_char=Dice(1, 3),
+            fnp_char=7,
+            options=options,
+            reroll=True,
+            engine=ev.EngineOptions(ev.NUMPY_BACKEND, epsilon=epsilon),
+        )
+        results.append(damage)
+    exact, pruned = results
+
+    discarded, bounds = ev.approximation_error(pruned, [1, 5])
+    assert exact.deficit() == 0
+    assert 0 < discarded < 0.01
+    assert len(pruned) < len(exact)
+    exact_outcomes = exact.outcomes()
+    for key, prob in pruned.outcomes().items():
+        assert prob <= exact_outcomes[key] + 1e-12
+    for ii, cap in enumerate([1, 5]):
+        exact_avg = ev.capped_damage_summary(exact, [cap], 1)[0][0]
+        pruned_avg = ev.capped_damage_summary(pruned, [cap], 1)[0][0]
+        assert 0 <= exact_avg - pruned_avg <= bounds[ii] + 1e-12
+
+
+def test_saved_roll():
+    options = AttackOptions(
+        half_range=False,
+        cover=False,
+        anti_active=False,
+        modifiers=(actions.sustained_hits(1), actions.lethal_hits, actions.devastating_wounds),
+    )
+    weapon = (Dice(1, 6), 3, 5, 4)
+    reached, _ = rl.attack_roll(*weapon, None, 1, Dice(1, 3), 5, options, True)
+    # Only wounds reach the save, as instances of SAVEABLE or UNSAVEABLE
+    assert reached.keys.shape[1] <= rl.UNSAVEABLE
+
+    for save_char, invulnerable_save, plain_save in [(2, 7, 2), (4, 7, 4), (7, 7, 7), (3, 4, 3), (6, 4, 5), (7, 5, 6)]:
+        expected, _ = rl.attack_roll(*weapon, plain_save, 1, Dice(1, 3), 5, options, True)
+        thinned = rl.saved_attack_roll(*weapon, save_char, 1, invulnerable_save, Dice(1, 3), 5, options)
+        expected_outcomes = expected.outcomes()
+        thinned_outcomes = thinned.outcomes()
+        assert expected_outcomes.keys() == thinned_outcomes.keys()
+        for key, prob in expected_outcomes.items():
+            assert abs(thinned_outcomes[key] - prob) < 1e-12
+
+
+def test_saved_tree_summary():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+    weapon = (Dice(1, 6), 3, 5, 4)
+    for fnp_char in [0, 6, 5]:
+        tree = rl.saved_attack_tree(*weapon, 4, 1, 5, Dice(1, 3), fnp_char, options)
+        expected, _ = rl.attack_roll(*weapon, 4, 1, Dice(1, 3), fnp_char, options, True)
+        # Summarising the compound per cap gives the same as summarising its expansion
+        averages, at_least = ev.capped_damage_summary(tree, [1, 2, 3], 8)
+        expected_averages, expected_at_least = ev.capped_damage_summary(expected, [1, 2, 3], 8)
+        assert np.allclose(averages, expected_averages, atol=1e-12)
+        assert np.allclose(at_least, expected_at_least, atol=1e-12)
+
+
+def test_damage_modifiers():
+    tree = ev.Distribution(np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [2, 0, 1]]), np.array([0.4, 0.3, 0.2, 0.1]))
+    halved = ev.modify_damage(tree, lambda damage: (damage + 1) // 2)
+    # Sizes 1 and 2 both become 1, so their outcomes merge
+    outcomes = {tuple(key): prob for key, prob in zip(halved.keys.tolist(), halved.probs, strict=True)}
+    assert outcomes.keys() == {(1, 0), (0, 1), (2, 1)}
+    assert np.allclose([outcomes[(1, 0)], outcomes[(0, 1)], outcomes[(2, 1)]], [0.7, 0.2, 0.1])
+
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+    weapon = (Dice(1, 6), 3, 5, 4, 4, 1, 7)
+    for damage_char, damage_modifiers, same_as in [
+        (3, ("-1 Damage",), 2),
+        (1, ("-1 Damage",), 1),
+        (Dice(1, 6), ("Halve Damage",), Dice(1, 3)),
+    ]:
+        for fnp_char in [0, 5]:
+            modified = rl.saved_attack_roll(*weapon, damage_char, fnp_char, options, damage_modifiers=damage_modifiers)
+            expected = rl.saved_attack_roll(*weapon, same_as, fnp_char, options)
+            expected_outcomes = expected.outcomes()
+            modified_outcomes = modified.outcomes()
+            assert expected_outcomes.keys() == modified_outcomes.keys()
+            for key, prob in expected_outcomes.items():
+                assert abs(modified_outcomes[key] - prob) < 1e-12
+
+    # Pruned stages that lost nothing still thin the modified damage
+    engine = ev.EngineOptions(ev.NUMPY_BACKEND, epsilon=1e-9)
+    pruned = rl.saved_attack_roll(*weapon, 3, 6, options, engine, damage_modifiers=("-1 Damage",))
+    exact = rl.saved_attack_roll(*weapon, 2, 6, options)
+    assert abs(ev.average_damage(pruned) - ev.average_damage(exact)) < 1e-6
+
+
+if __name__ == "__main__":
+    test_A4D1()
+    test_Ad6Dd3SH1()
+    test_A3D2LHDW()
+    test_A2Dd6RF()
+    test_power()
+    test_compound()
+    test_distribution()
+    test_outcome_cache()
+    test_budget()
+    test_pruning()
+    test_saved_roll()
+    test_saved_tree_summary()
+    test_damage_modifiers()
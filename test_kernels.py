@@ -0,0 +1,44 @@
+# ruff: noqa: N802, N806
+
+import roll as rl
+import events as ev
+from actions import AttackOptions
+from outcomes import Dice
+
+OPTIONS = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=tuple())
+
+
+def assert_same(first: dict, second: dict):
+    assert first.keys() == second.keys()
+    for key, prob in first.items():
+        assert abs(second[key] - prob) < 1e-12
+
+
+def test_thinned_damage():
+    # Each damage value expanded as the power of the feel no pain roll, as the generic engine would
+    fnp = rl.feel_no_pain_roll(5, OPTIONS, True)
+    expected = []
+    for value in [o.roll_value for o in Dice(1, 6, 1)()]:
+        powered = ev.evaluate(ev.Power(fnp, value))
+        expected.append(
+            ev.Together(
+                [
+                    ev.Leaf("a", ev.success(k.results[0]) if k.count else ev.failure(), probability=p)
+                    for k, p in powered.items()
+                ]
+            )
+        )
+    assert_same(
+        ev.collapse_tree(expected).outcomes(), rl.damage_roll(Dice(1, 6, 1), False, 5, OPTIONS, True).outcomes()
+    )
+
+
+def test_save_mixture():
+    damage = rl.damage_roll(Dice(1, 3), False, 6, OPTIONS, True)
+    expected = ev.collapse_tree([ev.Leaf("s", ev.failure())] * 3 + [damage] * 3)
+    assert_same(expected.outcomes(), rl.save_roll(4, 0, Dice(1, 3), 6, OPTIONS, True).outcomes())
+
+
+if __name__ == "__main__":
+    test_thinned_damage()
+    test_save_mixture()
@@ -0,0 +1,92 @@
+# ruff: noqa: N802, N806
+
+import os
+import tempfile
+
+import actions
+import moments
+from actions import AttackOptions
+from main import DataFile, targets, volley_data
+
+HEADER = "Unit,Weapon,Range,Attacks,Skill,Strength,AP,Damage,Modifier 1,Modifier 2,Modifier 3"
+LINES = [
+    "Fortis Kill Team,Astates grenade launcher - frag,24,D3,3,4,0,1,Blast,,",
+    "Fortis Kill Team,Astates grenade launcher - krak,24,1,3,9,-2,D3,,,",
+    "Fortis Kill Team,Bolt rifle,24,2,3,4,-1,1,,,",
+    "Fortis Kill Team,Close combat weapon,0,3,3,4,0,1,,,",
+]
+
+
+def read(lines: list[str]) -> DataFile:
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "units.csv")
+        with open(filename, "w") as fle:
+            fle.write("\n".join(lines) + "\n")
+        datafile = DataFile(filename)
+        datafile.read()
+    return datafile
+
+
+def test_models_column():
+    # Only one profile of the grenade launcher is fired, the other has an empty count
+    counts = ["1", "", "4", "5"]
+    datafile = read(["Models," + HEADER] + [f"{count},{line}" for count, line in zip(counts, LINES, strict=True)])
+    assert [line.models for line in datafile.lines] == [1, 0, 4, 5]
+    assert [line.weapon_name for line in datafile.lines] == [
+        "Astates Grenade Launcher - Frag",
+        "Astates Grenade Launcher - Krak",
+        "Bolt Rifle",
+        "Close Combat Weapon",
+    ]
+    assert list(datafile.units()) == ["Fortis Kill Team"]
+    volleys = datafile.volleys()
+    assert [(line.weapon_name, models) for line, models in volleys["Fortis Kill Team"]] == [
+        ("Astates Grenade Launcher - Frag", 1),
+        ("Bolt Rifle", 4),
+    ]
+
+
+def test_no_models_column():
+    # Without counts the alternative profiles can not be told apart, so there is no volley
+    datafile = read([HEADER] + LINES)
+    assert [line.models for line in datafile.lines] == [None] * len(LINES)
+    assert len(datafile.units()["Fortis Kill Team"]) == len(LINES)
+    assert datafile.volleys() == {}
+
+
+def test_bad_models_cell():
+    for counts in [["1", "two", "4", "5"], ["1", "", "4", "5.5"]]:
+        try:
+            read(["Models," + HEADER] + [f"{count},{line}" for count, line in zip(counts, LINES, strict=True)])
+        except ValueError as e:
+            assert "Models" in str(e)
+        else:
+            raise AssertionError(f"{counts} read")
+    # A row that ends before the Models column
+    try:
+        read([HEADER + ",,Models"] + LINES)
+    except ValueError as e:
+        assert "Models" in str(e)
+    else:
+        raise AssertionError("short row read")
+
+
+def test_shipped_volley():
+    datafile = DataFile(os.path.join("input", "Deathwatch.csv"))
+    datafile.read()
+    volleys = datafile.volleys()
+    assert {"Aggressor Squad", "Outrider Squad", "Redemptor Dreadnought"} <= set(volleys)
+    # Every weapon of the squad does 1 damage, so no wound cap changes the mean, which adds up over the weapons
+    options = AttackOptions(False, False, False, tuple())
+    weapons = [(line.create_weapon(actions.KeywordMap()), models) for line, models in volleys["Outrider Squad"]]
+    frame = volley_data(weapons, options)
+    for number, target in enumerate(targets()):
+        expected = sum(models * moments.expected_damage(weapon, target, options).mean for weapon, models in weapons)
+        assert abs(frame["damage_avg"][number * len(set(frame["Wounds"]))] - expected) < 1e-9
+
+
+if __name__ == "__main__":
+    test_models_column()
+    test_no_models_column()
+    test_bad_models_cell()
+    test_shipped_volley()
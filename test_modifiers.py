@@ -1,5 +1,7 @@
 # ruff: noqa: N802, N806
 
+import pickle
+
 from icecream import ic
 
 import roll as rl
@@ -67,6 +69,49 @@ def test_A1D1LH1():
     eo.test(damage.outcomes())
 
 
+def test_modifier_values():
+    assert actions.rapid_fire(1) == actions.rapid_fire(1)
+    assert actions.rapid_fire(1) != actions.rapid_fire(2)
+    assert hash(actions.sustained_hits(Dice(1, 3))) == hash(actions.sustained_hits(Dice(1, 3)))
+    assert pickle.loads(pickle.dumps(actions.anti("fly", 4))) == actions.anti("fly", 4)
+    assert pickle.loads(pickle.dumps(actions.lethal_hits)) is not actions.lethal_hits
+
+    assert actions.from_keyword("Rapid fire D3") == actions.rapid_fire(Dice(1, 3))
+    assert actions.from_keyword("Anti FLY 4") == actions.anti("fly", 4)
+    assert actions.from_keyword("Twin-linked") == actions.twin_linked
+    assert actions.KeywordMap()["sustained hits 2"] == actions.sustained_hits(2)
+
+    first = AttackOptions(False, False, False, (actions.sustained_hits(1), actions.critical_hits(5)))
+    second = AttackOptions(False, False, False, (actions.critical_hits(5), actions.sustained_hits(1)))
+    assert first == second
+    assert first.modifiers == (actions.critical_hits(5), actions.sustained_hits(1))
+
+
+def test_merged_outcomes():
+    options = AttackOptions(False, False, False, (actions.lethal_hits, actions.sustained_hits(Dice(1, 3))))
+    hits = actions.hit(options.modifiers, 3, options)
+    # A miss, a plain hit, and a lethal critical with each of the three sustained hits
+    assert len(hits) == 5
+    assert abs(sum(o.weight for o in hits) - 6) < 1e-12
+    assert {(o.value, o.weight) for o in hits if o.bypass_next} == {(2, 1 / 3), (3, 1 / 3), (4, 1 / 3)}
+
+    assert [(o.roll_value, o.weight) for o in Dice(2, 3)()] == [(2, 1), (3, 2), (4, 3), (5, 2), (6, 1)]
+
+
+def test_action_cache():
+    options = AttackOptions(False, False, False, (actions.lethal_hits, actions.twin_linked))
+    assert actions.wound.chain(options.modifiers) == (actions.twin_linked,)
+    assert actions.wound.chain(options.modifiers) is actions.wound.chain(options.modifiers)
+
+    first = actions.wound(options.modifiers, 4, 5, options)
+    before = actions.wound.cache_info()
+    assert actions.wound(options.modifiers, 4, 5, options) == first
+    assert actions.wound.cache_info().hits == before.hits + 1
+
+
 if __name__ == "__main__":
     test_A1D1SH1()
     test_A1D1LH1()
+    test_modifier_values()
+    test_merged_outcomes()
+    test_action_cache()
@@ -0,0 +1,64 @@
+# ruff: noqa: N802, N806
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import actions
+import events as ev
+import montecarlo as mc
+import roll as rl
+from actions import AttackOptions
+from outcomes import Dice
+
+CAPS = [1, 3, 14]
+SIMULATION = mc.SimulationOptions(trials=200_000)
+
+
+def simulate_and_compute(modifiers, attack_char, damage_char, fnp_char=7, simulation=SIMULATION):
+    options = AttackOptions(half_range=True, cover=False, anti_active=False, modifiers=modifiers)
+    arguments = (attack_char, 3, 5, 4, 4, 1, damage_char, fnp_char, options)
+    engine = ev.EngineOptions(ev.NUMPY_BACKEND, horizon=max(CAPS))
+    exact, _ = rl.attack_roll(*arguments, True, engine)
+    return exact, mc.simulate(*arguments, engine, simulation)
+
+
+def test_agrees_with_exact():
+    for modifiers, attack_char, damage_char, fnp_char in [
+        ((), 4, 1, 7),
+        ((actions.sustained_hits(1), actions.lethal_hits), Dice(2, 6), Dice(1, 3), 5),
+        ((actions.devastating_wounds, actions.twin_linked, actions.reroll_hit_1), Dice(1, 6), 2, 6),
+        ((actions.torrent, actions.melta(2)), Dice(1, 6), Dice(1, 6), 7),
+    ]:
+        exact, simulated = simulate_and_compute(modifiers, attack_char, damage_char, fnp_char)
+        averages, at_least = ev.capped_damage_summary(exact, CAPS, 5)
+        estimates, estimated, average_errors, at_least_errors = mc.simulated_damage_summary(
+            simulated, CAPS, 5, SIMULATION.trials
+        )
+        assert np.all(np.abs(estimates - averages) <= 5 * average_errors + 1e-12)
+        assert np.all(np.abs(estimated - at_least) <= 5 * at_least_errors + 1e-3)
+
+
+def test_reproducible():
+    simulation = mc.SimulationOptions(trials=30_000, chunk_size=7_000, seed=3)
+    _, first = simulate_and_compute((actions.sustained_hits(1),), Dice(1, 6), Dice(1, 3), simulation=simulation)
+    _, second = simulate_and_compute((actions.sustained_hits(1),), Dice(1, 6), Dice(1, 3), simulation=simulation)
+    assert first.outcomes() == second.outcomes()
+    assert abs(first.probs.sum() - 1) < 1e-12
+
+    # The chunks have their own streams, so running them in parallel changes nothing
+    options = AttackOptions(half_range=True, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1),))
+    with ThreadPoolExecutor(4) as executor:
+        parallel = mc.simulate(
+            Dice(1, 6), 3, 5, 4, 4, 1, Dice(1, 3), 7, options, simulation=simulation, mapper=executor.map
+        )
+    assert parallel.outcomes() == first.outcomes()
+
+    other = mc.SimulationOptions(trials=30_000, chunk_size=7_000, seed=4)
+    _, third = simulate_and_compute((actions.sustained_hits(1),), Dice(1, 6), Dice(1, 3), simulation=other)
+    assert third.outcomes() != first.outcomes()
+
+
+if __name__ == "__main__":
+    test_agrees_with_exact()
+    test_reproducible()
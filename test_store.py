@@ -0,0 +1,85 @@
+# ruff: noqa: N802, N806
+
+import tempfile
+
+import numpy as np
+
+import roll as rl
+import store
+from actions import AttackOptions
+import actions
+from outcomes import Dice
+
+STAGES = [rl.feel_no_pain_roll, rl.damage_roll, rl.save_roll, rl.wound_roll, rl.hit_roll, rl.attack_roll]
+
+
+def clear_stages():
+    for stage in STAGES:
+        stage.cache_clear()
+
+
+def roll():
+    options = AttackOptions(half_range=False, cover=False, anti_active=False, modifiers=(actions.lethal_hits,))
+    return rl.attack_roll(Dice(1, 6), 3, 4, 4, 4, -1, Dice(1, 3), 5, options, True)
+
+
+def test_persisted_between_runs():
+    with tempfile.TemporaryDirectory() as directory:
+        clear_stages()
+        expected, expected_possibilities = roll()
+        try:
+            first = store.configure(directory)
+            clear_stages()
+            roll()
+            assert first.stats.hits == 0
+            assert first.stats.writes > 0
+
+            # A new store over the same directory stands in for a later run
+            second = store.configure(directory)
+            clear_stages()
+            damage, possibilities = roll()
+            assert second.stats.hits == 1
+            assert second.stats.writes == 0
+            assert possibilities == expected_possibilities
+            assert np.array_equal(damage.keys, expected.keys)
+            assert np.array_equal(damage.probs, expected.probs)
+        finally:
+            store.configure(None)
+            clear_stages()
+
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as directory:
+        persistent = store.StageStore(directory, max_bytes=1000)
+        for ii in range(10):
+            persistent.put(persistent.key("test", (ii,)), "test", np.zeros(40))
+        assert persistent.size() <= 1000
+        assert persistent.stats.evictions > 0
+        # The most recent entry is kept, the oldest is not
+        assert persistent.get(persistent.key("test", (9,))) is not None
+        assert persistent.get(persistent.key("test", (0,))) is None
+
+
+def test_eviction_keeps_read_entries():
+    with tempfile.TemporaryDirectory() as directory:
+        persistent = store.StageStore(directory, max_bytes=3000)
+        for ii in range(5):
+            persistent.put(persistent.key("test", (ii,)), "test", np.zeros(40))
+        # Replacing an entry does not count it twice
+        persistent.put(persistent.key("test", (4,)), "test", np.zeros(40))
+        with persistent._connection() as conn:
+            assert persistent.size() == conn.execute("SELECT TOTAL(size) FROM entries").fetchone()[0]
+
+        # The oldest entry is read, so it is not the one evicted, even though its use is not written yet
+        assert persistent.get(persistent.key("test", (0,))) is not None
+        for ii in range(5, 8):
+            persistent.put(persistent.key("test", (ii,)), "test", np.zeros(40))
+        assert persistent.size() <= 3000
+        assert persistent.get(persistent.key("test", (0,))) is not None
+        assert persistent.get(persistent.key("test", (1,))) is None
+
+
+if __name__ == "__main__":
+    test_persisted_between_runs()
+    test_eviction()
+    test_eviction_keeps_read_entries()
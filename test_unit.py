@@ -0,0 +1,71 @@
+# ruff: noqa: N802, N806
+
+import itertools
+
+import numpy as np
+
+import actions
+import events as ev
+import kernels
+import roll as rl
+import unit
+from actions import AttackOptions
+from outcomes import Dice
+
+
+def allocate(state: tuple[int, int], damage: int, wounds: int, spill: bool) -> tuple[int, int]:
+    removed, taken = state
+    if spill:
+        return removed + (taken + damage) // wounds, (taken + damage) % wounds
+    elif taken + damage >= wounds:
+        return removed + 1, 0
+    return removed, taken + damage
+
+
+def test_models_killed():
+    # 0 to 3 damage, as a single damage roll
+    damage = kernels.thinned_damage([1, 3], 0.5, [2.0, 1.0])
+    chances = np.bincount(damage.totals(), weights=damage.probs)
+    rolls = {(0, 0): 0.1, (1, 0): 0.2, (2, 1): 0.3, (3, 2): 0.4}
+    for models, wounds, spill in [(1, 2, False), (3, 2, False), (3, 2, True), (2, 3, True)]:
+        # Every sequence the rolls could come up in, the ones that bypass the save last
+        expected = np.zeros(models + 1)
+        for (count, mortal), prob in rolls.items():
+            for amounts in itertools.product(range(len(chances)), repeat=count + mortal):
+                state = (0, 0)
+                for ii, amount in enumerate(amounts):
+                    state = allocate(state, amount, wounds, spill and ii >= count)
+                expected[min(state[0], models)] += prob * np.prod(chances[list(amounts)])
+        assert np.allclose(unit.models_killed(damage, rolls, models, wounds, spill), expected, atol=1e-12)
+
+
+def test_single_model():
+    # A unit of one model is killed as often as its capped damage reaches its wounds
+    options = AttackOptions(
+        half_range=False, cover=False, anti_active=False, modifiers=(actions.sustained_hits(1), actions.lethal_hits)
+    )
+    weapon = (Dice(2, 6), 3, 5, 4, 4, 1, 7, Dice(1, 3), 5)
+    tree = rl.saved_attack_tree(*weapon, options)
+    _, at_least = ev.capped_damage_summary(tree, [1, 2, 3], 3)
+    for wounds in [1, 2, 3]:
+        killed = rl.unit_attack_roll(*weapon, 1, wounds, options)
+        assert abs(killed[1] - at_least[wounds - 1, wounds - 1]) < 1e-12
+
+
+def test_large_unit():
+    options = AttackOptions(
+        half_range=False, cover=False, anti_active=False, modifiers=(actions.devastating_wounds, actions.twin_linked)
+    )
+    weapon = (Dice(3, 6), 3, 5, 4, 4, 1, 7, 2, 0)
+    spilling = rl.unit_attack_roll(*weapon, 20, 1, options)
+    lost = rl.unit_attack_roll(*weapon, 20, 1, options, spill=False)
+    assert abs(spilling.sum() - 1) < 1e-9
+    assert abs(lost.sum() - 1) < 1e-9
+    # Devastating wounds do 2 damage to single wound models, which only kills 2 of them when it spills
+    assert np.arange(21) @ spilling > np.arange(21) @ lost
+
+
+if __name__ == "__main__":
+    test_models_killed()
+    test_single_model()
+    test_large_unit()
@@ -0,0 +1,77 @@
+import numpy as np
+
+import events as ev
+from events import Probability
+
+
+def _transitions(damage: np.ndarray, models: int, wounds: int, spill: bool) -> np.ndarray:
+    """
+    The chance of moving between states with one roll of damage, where damage[d] is the chance of d damage.
+    State r * wounds + t has r models removed and t damage on the next, state models * wounds has none left.
+    """
+    states = models * wounds + 1
+    removed, taken = np.divmod(np.arange(states - 1), wounds)
+    amounts = np.arange(len(damage))
+    total = taken[:, None] + amounts[None, :]
+    if spill:
+        # Damage left over from a removed model goes on to the next
+        removed = removed[:, None] + total // wounds
+        taken = total % wounds
+    else:
+        # Damage left over from a removed model is lost
+        dies = total >= wounds
+        removed = removed[:, None] + dies
+        taken = np.where(dies, 0, total)
+    destination = np.where(removed >= models, states - 1, removed * wounds + taken)
+
+    transitions = np.zeros((states, states))
+    np.add.at(
+        transitions,
+        (np.repeat(np.arange(states - 1), len(damage)), destination.reshape(-1)),
+        np.tile(damage, states - 1),
+    )
+    transitions[states - 1, states - 1] = damage.sum()
+    return transitions
+
+
+def models_killed(
+    damage: ev.Distribution,
+    rolls: dict[tuple[int, int], Probability],
+    models: int,
+    wounds: int,
+    spill: bool = True,
+) -> np.ndarray:
+    """
+    The chance of 0..models models of a unit, each with the wounds, being removed.
+    damage is the distribution of a single damage roll, and rolls the chance of each number of rolls that go through
+    the save and of those that bypass it. The damage of the first is allocated one roll at a time, then that of the
+    second, which spills over onto the next model when spill is set, as mortal wounds do.
+    The unit is a state of how many models are removed and how much damage is on the next, so the work grows with the
+    size of the unit and the number of rolls, not with the orders the rolls could be allocated in.
+    """
+    # A single roll is at most one instance, whose size is the damage it does
+    assert damage.keys.sum(axis=1).max(initial=0) <= 1
+    chances = np.bincount(damage.totals(), weights=damage.probs)
+    states = models * wounds + 1
+
+    saved = _transitions(chances, models, wounds, False)
+    state = np.zeros(states)
+    state[0] = 1.0
+    # For each number of mortal rolls, the states every number of allocated rolls leaves weighted by their chance
+    pending = np.zeros((max(m for _, m in rolls) + 1, states))
+    by_count: dict[int, list[tuple[int, Probability]]] = {}
+    for (count, mortal), prob in rolls.items():
+        by_count.setdefault(count, []).append((mortal, prob))
+    for count in range(max(by_count) + 1):
+        for mortal, prob in by_count.get(count, []):
+            pending[mortal] += prob * state
+        state = state @ saved
+
+    # Horner's rule, so every number of mortal rolls shares the same products
+    mortals = _transitions(chances, models, wounds, True) if spill else saved
+    result = pending[-1]
+    for mortal in range(len(pending) - 2, -1, -1):
+        result = result @ mortals + pending[mortal]
+
+    killed = np.minimum(np.arange(states) // wounds, models)
+    return np.bincount(killed, weights=result, minlength=models + 1)
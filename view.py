@@ -21,13 +21,21 @@ if __name__ == "__main__":
     for root, _, files in os.walk(data_dir):
         for file in files:
             weapon_name, ext = os.path.splitext(file)
-            if ext == ".csv":
+            # Moments only files have no distribution to tabulate
+            if ext == ".csv" and not weapon_name.endswith(".moments"):
                 part, unit_name = os.path.split(root)
                 _, group_name = os.path.split(part)
 
                 ic(os.path.join(root, file))
 
                 df = pl.read_csv(os.path.join(root, file))
+                if "Invulnerable" in df.columns:
+                    # The tables are of armour saves alone
+                    df = df.filter(pl.col("Invulnerable") == 7)
+                if "FNP" in df.columns:
+                    df = df.filter(pl.col("FNP") == 0)
+                if "Damage Modifier" in df.columns:
+                    df = df.filter(pl.col("Damage Modifier") == "None")
 
                 max_average_damage = max(df["damage_avg"]) * 1.1
 